@@ -0,0 +1,187 @@
+"""
+This script benchmarks each stage of the starxly pipeline on
+reproducible generated workloads. It reports throughput, in the unit
+each stage counts, and peak memory for lexing, parsing, compiling,
+executing and the full run, and can save the results as a baseline
+JSON file or compare them against one to catch regressions.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+import starxly
+
+STAGES = ('lex', 'parse', 'compile', 'execute', 'run')
+# Unit each stage's throughput is reported in, counted by the stage itself, run counts the tokens lexed
+UNITS = {'lex': 'tokens', 'parse': 'tokens', 'compile': 'nodes', 'execute': 'instructions', 'run': 'tokens'}
+
+def random_number(random_generator, float_chance=0.0):
+    """Returns a random int literal, or a float literal with the given chance"""
+    if random_generator.random() < float_chance:
+        return '{:.4f}'.format(random_generator.random() * 1000)
+    return str(random_generator.randint(1, 1000))
+
+def wide_sum(size, seed):
+    """One long flat chain of additions and subtractions"""
+    random_generator = random.Random(seed)
+    parts = [random_number(random_generator)]
+    for i in range(size - 1):
+        parts.append(random_generator.choice('+-'))
+        parts.append(random_number(random_generator))
+    return [' '.join(parts)]
+
+def deep_parentheses(size, seed):
+    """One expression where every operation nests inside the parentheses of the previous one"""
+    random_generator = random.Random(seed)
+    opening = ''.join('({} {} '.format(random_number(random_generator), random_generator.choice('+-*')) for i in range(size - 1))
+    return [opening + random_number(random_generator) + ')' * (size - 1)]
+
+def unary_chain(size, seed):
+    """Many expressions made of long runs of unary operators"""
+    random_generator = random.Random(seed)
+    texts = []
+    for i in range(10):
+        operators = ''.join(random_generator.choice('+-') for j in range(size // 10))
+        texts.append(operators + random_number(random_generator))
+    return texts
+
+def mixed_numbers(size, seed):
+    """Many expressions mixing ints and floats with all operators and some parentheses"""
+    random_generator = random.Random(seed)
+    texts = []
+    for i in range(max(size // 20, 1)):
+        parts = []
+        for j in range(20):
+            if j:
+                parts.append(random_generator.choice('+-*/'))
+            number = random_number(random_generator, 0.5)
+            if random_generator.random() < 0.2:
+                number = '-' + number
+            if random_generator.random() < 0.2:
+                number = '({} {} {})'.format(number, random_generator.choice('+-*'), random_number(random_generator, 0.5))
+            parts.append(number)
+        texts.append(' '.join(parts))
+    return texts
+
+def error_heavy(size, seed):
+    """Many short expressions most of which fail to lex, parse or run"""
+    random_generator = random.Random(seed)
+    templates = ('{} / (1 - 1)', '{} + $', '({} * 2', '{} {}', '{} + * 3', '{} - 2')
+    texts = []
+    for i in range(max(size // 5, 1)):
+        template = random_generator.choice(templates)
+        texts.append(template.format(random_number(random_generator), random_number(random_generator)))
+    return texts
+
+WORKLOADS = {
+    'wide_sum': wide_sum,
+    'deep_parentheses': deep_parentheses,
+    'unary_chain': unary_chain,
+    'mixed_numbers': mixed_numbers,
+    'error_heavy': error_heavy,
+}
+
+def time_workload(texts, repeat):
+    """Times every stage on the texts, returning the best seconds and the count of each stage in its own unit"""
+    best = {stage: float('inf') for stage in STAGES}
+    counts = {}
+    for i in range(repeat):
+        tracer = starxly.Tracer()
+        for text in texts:
+            starxly.run('<benchmark>', text, tracer=tracer)
+        for stage in STAGES[:-1]:
+            if stage in tracer.stats:
+                best[stage] = min(best[stage], tracer.stats[stage].seconds)
+                counts[stage] = tracer.stats[stage].count
+        counts['run'] = counts['lex']
+        started_at = time.perf_counter()
+        for text in texts:
+            starxly.run('<benchmark>', text)
+        best['run'] = min(best['run'], time.perf_counter() - started_at)
+    return best, counts
+
+def measure_peaks(texts):
+    """Returns the peak memory of every stage and of a whole run over one pass of the texts each"""
+    tracer = starxly.Tracer(track_allocations=True)
+    for text in texts:
+        starxly.run('<benchmark>', text, tracer=tracer)
+    peaks = {stage: stage_stats.peak_bytes for stage, stage_stats in tracer.stats.items()}
+    # Separate pass for run, so the peak includes everything a run holds at once across its stages
+    peaks['run'] = 0
+    tracemalloc.start()
+    try:
+        for text in texts:
+            tracemalloc.reset_peak()
+            memory_at_start = tracemalloc.get_traced_memory()[0]
+            result = starxly.run('<benchmark>', text)
+            peaks['run'] = max(peaks['run'], tracemalloc.get_traced_memory()[1] - memory_at_start)
+            del result
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def benchmark(size, repeat, seed):
+    """Runs every workload and returns the results as a JSON serializable dict"""
+    results = {}
+    for name, generate in WORKLOADS.items():
+        texts = generate(size, seed)
+        best, counts = time_workload(texts, repeat)
+        peaks = measure_peaks(texts)
+        results[name] = {}
+        for stage in STAGES:
+            seconds = best[stage]
+            if seconds == float('inf'):
+                continue # Stage never ran, every text failed before reaching it
+            results[name][stage] = {
+                'seconds': seconds,
+                'count': counts[stage],
+                'unit': UNITS[stage],
+                'per_second': counts[stage] / seconds if seconds else 0.0,
+                'peak_bytes': peaks.get(stage, 0),
+            }
+    return results
+
+def report(results, baseline=None, threshold=0.1):
+    """Prints the results, comparing them against baseline if given. Returns the number of regressions"""
+    regressions = 0
+    print('{:<18} {:<8} {:>11} {:>14} {:<12} {:>12} {:>9}'.format('workload', 'stage', 'seconds', 'per second', 'unit', 'peak bytes', 'change'))
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            change = ''
+            if baseline and stage in baseline.get(name, {}):
+                previous = baseline[name][stage]['seconds']
+                ratio = result['seconds'] / previous - 1 if previous else 0.0
+                change = '{:+.1%}'.format(ratio)
+                if ratio > threshold:
+                    change += ' !'
+                    regressions += 1
+            print('{:<18} {:<8} {:>11.6f} {:>14,.0f} {:<12} {:>12,} {:>9}'.format(name, stage, result['seconds'], result['per_second'], result['unit'], result['peak_bytes'], change))
+    return regressions
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark the stages of the starxly pipeline')
+    argument_parser.add_argument('--size', type=int, default=20000, help='number of terms in each workload')
+    argument_parser.add_argument('--repeat', type=int, default=5, help='number of timed passes, the best one is kept')
+    argument_parser.add_argument('--seed', type=int, default=0, help='seed for the workload generators')
+    argument_parser.add_argument('--save', metavar='JSON', help='write the results to a baseline file')
+    argument_parser.add_argument('--compare', metavar='JSON', help='compare the results against a baseline file')
+    argument_parser.add_argument('--threshold', type=float, default=0.1, help='slowdown counted as a regression, 0.1 is 10%%')
+    arguments = argument_parser.parse_args()
+
+    results = benchmark(arguments.size, arguments.repeat, arguments.seed)
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            baseline = json.load(file)
+    regressions = report(results, baseline, arguments.threshold)
+    if arguments.save:
+        with open(arguments.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if regressions:
+        print('{} stage(s) regressed by more than {:.0%}'.format(regressions, arguments.threshold))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
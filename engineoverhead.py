@@ -0,0 +1,57 @@
+"""
+This script measures the per call overhead of running small programs
+through run, which builds a new lexer, parser, compiler and virtual
+machine every time, against a single shared Engine, both from one
+thread and from a pool of threads sharing the engine.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import starxly
+
+PROGRAMS = (
+    '42',
+    '1 + 2',
+    '(1 + 2) * 3 - 4 / 5',
+    '-(12.5 * (3 - 1)) + 7 / (2 + 0.5) * -3',
+    '1 / (2 - 2)',
+)
+
+def per_call(function, texts, repeat):
+    """Returns the best microseconds per call of function over the texts"""
+    best = float('inf')
+    for i in range(repeat):
+        started_at = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - started_at)
+    return best / len(texts) * 1e6
+
+def threaded(function, texts, threads):
+    """Returns the microseconds per call when threads share the work of calling function on the texts"""
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        started_at = time.perf_counter()
+        for result in executor.map(function, texts, chunksize=max(len(texts) // (4 * threads), 1)):
+            pass
+        return (time.perf_counter() - started_at) / len(texts) * 1e6
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Compare the per call overhead of run and Engine.run')
+    argument_parser.add_argument('--calls', type=int, default=20000, help='calls per program and timed pass')
+    argument_parser.add_argument('--repeat', type=int, default=5, help='number of timed passes, the best one is kept')
+    argument_parser.add_argument('--threads', type=int, default=4, help='threads sharing one engine')
+    arguments = argument_parser.parse_args()
+
+    engine = starxly.Engine('<benchmark>')
+    def run(text):
+        return starxly.run('<benchmark>', text)
+    print('{:<42} {:>10} {:>10} {:>8} {:>14}'.format('program', 'run us', 'engine us', 'speedup', 'threaded us'))
+    for program in PROGRAMS:
+        texts = [program] * arguments.calls
+        run_time = per_call(run, texts, arguments.repeat)
+        engine_time = per_call(engine.run, texts, arguments.repeat)
+        threaded_time = threaded(engine.run, texts, arguments.threads)
+        print('{:<42} {:>10.2f} {:>10.2f} {:>7.1f}x {:>14.2f}'.format(program, run_time, engine_time, run_time / engine_time, threaded_time))
+
+if __name__ == '__main__':
+    main()
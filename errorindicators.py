@@ -1,11 +1,24 @@
-def indicate_error(text, position_start, position_end):
+from array import array
+from bisect import bisect_left, bisect_right
+
+def find_line_starts(text):
+    """Function to find the index every line of text starts at, so lines can be looked up with a bisect"""
+    line_starts = array('q', [0])
+    index = text.find('\n')
+    while index >= 0:
+        line_starts.append(index + 1)
+        index = text.find('\n', index + 1)
+    return line_starts
+
+def indicate_error(text, position_start, position_end, line_starts=None):
     """Function to indicate to user exactly where error occurred using string with arrows pointing at sources of error"""
-    result = ''
-    # Calculate indices
-    start_index = max(text.rfind('\n', 0, position_start.index), 0)
-    end_index = text.find('\n', start_index + 1)
-    if end_index < 0:
-        end_index = len(text)
+    if line_starts is None:
+        line_starts = find_line_starts(text)
+    result = []
+    # Calculate indices, start_index is the newline before the line (or 0 on the first line) and end_index the newline after it
+    line = bisect_right(line_starts, position_start.index) - 1
+    start_index = line_starts[line] - 1 if line > 0 else 0
+    end_index = next_newline(text, line_starts, start_index + 1)
     # Generate each line
     line_count = position_end.line_number - position_start.line_number + 1
     for i in range(line_count):
@@ -14,11 +27,14 @@ def indicate_error(text, position_start, position_end):
         start_column_index = position_start.column_number if i == 0 else 0
         end_column_index = position_end.column_number if i == line_count - 1 else len(line) - 1
         # Append to result
-        result += line + '\n'
-        result += ' ' * start_column_index + '^' * (end_column_index - start_column_index)
+        result.append(line + '\n')
+        result.append(' ' * start_column_index + '^' * (end_column_index - start_column_index))
         # Re-calculate indices
         start_index = end_index
-        end_index = text.find('\n', start_index + 1)
-        if end_index < 0:
-            end_index = len(text)
-    return result.replace('\t', '')
\ No newline at end of file
+        end_index = next_newline(text, line_starts, start_index + 1)
+    return ''.join(result).replace('\t', '')
+
+def next_newline(text, line_starts, index):
+    """Function to find the first newline at or after index, or the end of text when there is none"""
+    line = bisect_left(line_starts, index + 1)
+    return line_starts[line] - 1 if line < len(line_starts) else len(text)
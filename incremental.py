@@ -0,0 +1,293 @@
+"""
+This module keeps a starxly program alive between edits so that only
+the part that changed is lexed, parsed and evaluated again. It is
+meant for the interactive shell, where long expressions are pasted
+once and then tweaked a little at a time.
+
+- Tokens before the edit keep their offsets from the start of the
+  text and tokens after it keep their offsets from the end, so an
+  edit leaves both untouched. Only tokens between the previous and
+  the current edit change anchor, much like a gap buffer. Only the
+  tokens touching the edit are lexed again.
+- The parser state before every token is kept on persistent stacks,
+  so parsing resumes right before the first changed token with the
+  nodes built for everything to its left. Parenthesized groups after
+  the edit parse the same in any context, their nodes are reused
+  without looking at their tokens.
+- The value of every node is cached, evaluation stops descending as
+  soon as it reaches a node it has already evaluated.
+"""
+from bisect import bisect_left, bisect_right
+import starxly
+from starxly import (BinaryOperatorNode, Context, InvalidSyntaxError, Number, NumberNode, OffsetToken, RegexLexer,
+                     RunTimeError, SourceText, StarxlyException, Token, UnaryOperatorNode)
+
+class TailSource:
+    """Source for tokens anchored to the end of the text, their offsets count back from the end"""
+    __slots__ = ('head',)
+
+    def __init__(self, head):
+        self.head = head
+
+    def position(self, index):
+        return self.head.position(len(self.head.text) - index)
+
+class Group:
+    """Parenthesized group found by the last parse, keyed by its opening token"""
+    __slots__ = ('node', 'closing_token', 'index', 'length')
+
+    def __init__(self, node, closing_token, index, length):
+        self.node = node
+        self.closing_token = closing_token
+        self.index = index
+        self.length = length
+
+class IncrementalSession:
+    """
+    Program that can be edited and run again, giving the same result as
+    starxly.run on the new text every time while reusing the tokens,
+    nodes and values left over from the previous text.
+    """
+    PAREN = starxly.StackParser.PAREN
+    UNARY = starxly.StackParser.UNARY
+    PRECEDENCE = starxly.StackParser.PRECEDENCE
+
+    def __init__(self, filename='<stdin>'):
+        self.filename = filename
+        self.head = SourceText(filename, '')
+        self.tail = TailSource(self.head)
+        self.tokens = None # None until a text has been lexed without errors
+        self.gap = 0 # tokens[:gap] are anchored to the start of the text, tokens[gap:] to the end
+        self.states = [] # Parser state before each token, None where the token was skipped as part of a group
+        self.groups = {}
+        self.values = {}
+
+    @property
+    def text(self):
+        return self.head.text
+
+    def update(self, text):
+        """Replaces the program text and runs it, returning (value, error) like starxly.run"""
+        try:
+            resume_index, reusable_from = self.relex(text)
+            root = self.parse(resume_index, reusable_from)
+            return self.evaluate(root, Context('<program>')), None
+        except StarxlyException as exception:
+            return None, exception.error
+
+    def start_of(self, token):
+        return token.start if token.source is self.head else len(self.head.text) - token.start
+
+    def end_of(self, token):
+        return token.end if token.source is self.head else len(self.head.text) - token.end
+
+    def relex(self, text):
+        """
+        Brings the token list up to date with text, lexing only the tokens
+        the edit touched. Returns the index parsing has to resume from and
+        the index from which tokens were left as they were.
+        """
+        if self.tokens is None:
+            return self.relex_all(text)
+        old_text = self.head.text
+        # Find the changed range, old_text[start:old_end] was replaced by text[start:new_end]
+        limit = min(len(old_text), len(text))
+        start = 0
+        while start < limit and old_text[start] == text[start]:
+            start += 1
+        suffix = 0
+        while suffix < limit - start and old_text[-1 - suffix] == text[-1 - suffix]:
+            suffix += 1
+        old_end = len(old_text) - suffix
+        shift = len(text) - len(old_text)
+        # Tokens touching the changed range, including neighbours a number could merge with
+        tokens = self.tokens
+        first = bisect_left(tokens, start, key=self.end_of)
+        last = bisect_right(tokens, old_end, key=self.start_of)
+        self.move_gap(first, last)
+        lex_start = min(self.start_of(tokens[first]), start) # The end of file token always comes after start
+        lex_end = self.start_of(tokens[last]) + shift if last < len(tokens) else len(text)
+        # Switch the shared source over to the new text, offsets of untouched tokens stay valid
+        self.head.text = text
+        self.head.line_starts = None
+        new_tokens = self.lex(text, lex_start, lex_end)
+        self.gap = first + len(new_tokens)
+        if last == len(tokens):
+            new_tokens.append(OffsetToken(Token.TT_EOF, None, 0, -1, self.tail))
+        tokens[first:last] = new_tokens
+        reusable_from = first + len(new_tokens)
+        # Forget groups the edit reached into and move the ones after it to their new index
+        groups = {}
+        for opening_token, group in self.groups.items():
+            if group.index + group.length <= first:
+                groups[opening_token] = group
+            elif group.index >= last:
+                group.index += reusable_from - last
+                groups[opening_token] = group
+        self.groups = groups
+        return first, reusable_from
+
+    def relex_all(self, text):
+        """Lexes text from scratch"""
+        self.head.text = text
+        self.head.line_starts = None
+        tokens, error = RegexLexer(self.filename, text).tokenize(source=self.head)
+        if error:
+            raise StarxlyException(error)
+        self.tokens = tokens
+        self.gap = len(tokens)
+        self.states = []
+        self.groups = {}
+        return 0, len(tokens)
+
+    def move_gap(self, first, last):
+        """Re-anchors tokens so that tokens[:first] count from the start and tokens[last:] from the end"""
+        tokens = self.tokens
+        length = len(self.head.text)
+        for index in range(last, self.gap):
+            token = tokens[index]
+            token.start = length - token.start
+            token.end = length - token.end
+            token.source = self.tail
+        for index in range(self.gap, first):
+            token = tokens[index]
+            token.start = length - token.start
+            token.end = length - token.end
+            token.source = self.head
+        self.gap = min(max(self.gap, first), last)
+
+    def lex(self, text, start, end):
+        """Lexes text[start:end] into tokens anchored to the start of the text"""
+        tokens, error = RegexLexer(self.filename, text).tokenize(start, end, self.head)
+        if error:
+            self.tokens = None # Token list no longer matches the text, lex everything next time
+            raise StarxlyException(error)
+        return tokens
+
+    def parse(self, index, reusable_from):
+        """
+        Parses like StackParser, resuming from the last parser state kept at
+        or before index. Operands and operators are persistent linked stacks
+        of tuples so keeping the state before every token is cheap.
+        """
+        states = self.states
+        index = min(index, len(states) - 1)
+        while index > 0 and states[index] is None:
+            index -= 1
+        if index >= 0:
+            operands, operators, expect_operand = states[index]
+        else:
+            index = 0
+            operands, operators, expect_operand = None, None, True
+        del states[index:]
+        tokens = self.tokens
+        groups = self.groups
+        while True:
+            states.append((operands, operators, expect_operand))
+            token = tokens[index]
+            token_type = token.type
+            if expect_operand:
+                if token_type == Token.TT_INT or token_type == Token.TT_FLOAT:
+                    operands = self.reduce_unary((NumberNode(token), operands), operators)
+                    operators = self.pop_unary(operators)
+                    expect_operand = False
+                elif token_type == Token.TT_PLUS or token_type == Token.TT_MINUS:
+                    operators = (token, self.UNARY, index, operators)
+                elif token_type == Token.TT_LPAREN:
+                    group = groups.get(token) if index >= reusable_from else None
+                    if group is not None and group.index == index and tokens[index + group.length - 1] is group.closing_token:
+                        # Group is unchanged, use its node and skip over its tokens
+                        operands = self.reduce_unary((group.node, operands), operators)
+                        operators = self.pop_unary(operators)
+                        expect_operand = False
+                        states.extend([None] * (group.length - 1))
+                        index += group.length
+                        continue
+                    operators = (token, self.PAREN, index, operators)
+                else:
+                    raise StarxlyException(InvalidSyntaxError(token.position_start, token.position_end, 'Expected int of float'))
+            elif token_type in self.PRECEDENCE:
+                precedence = self.PRECEDENCE[token_type]
+                operands, operators = self.reduce_binary(operands, operators, precedence)
+                operators = (token, precedence, index, operators)
+                expect_operand = True
+            else:
+                operands, operators = self.reduce_binary(operands, operators, 1)
+                if operators:
+                    if token_type != Token.TT_RPAREN:
+                        raise StarxlyException(InvalidSyntaxError(token.position_start, token.position_end, "Expected ')'"))
+                    opening_token, precedence, opening_index, operators = operators
+                    groups[opening_token] = Group(operands[0], token, opening_index, index - opening_index + 1)
+                    operands = self.reduce_unary(operands, operators)
+                    operators = self.pop_unary(operators)
+                elif token_type != Token.TT_EOF:
+                    raise StarxlyException(InvalidSyntaxError(token.position_start, token.position_end, "Expected '+', '-', '*' or '/'"))
+                else:
+                    return operands[0]
+            index += 1
+
+    def reduce_binary(self, operands, operators, minimum_precedence):
+        """Combines operands using the binary operators on top of the stack that bind at least as tightly as minimum_precedence"""
+        while operators and operators[1] >= minimum_precedence:
+            right, (left, operands) = operands
+            operands = (BinaryOperatorNode(left, operators[0], right), operands)
+            operators = operators[3]
+        return operands, operators
+
+    def reduce_unary(self, operands, operators):
+        """Applies the unary operators waiting on the operand on top of the stack"""
+        node, rest = operands
+        while operators and operators[1] == self.UNARY:
+            node = UnaryOperatorNode(operators[0], node)
+            operators = operators[3]
+        return (node, rest)
+
+    def pop_unary(self, operators):
+        """Removes the unary operators reduce_unary applied"""
+        while operators and operators[1] == self.UNARY:
+            operators = operators[3]
+        return operators
+
+    def evaluate(self, root, context):
+        """Evaluates the tree like the VirtualMachine, reusing the cached value of every node seen before"""
+        values = self.values
+        new_values = {}
+        self.values = new_values # Only nodes of the current tree are kept
+        results = []
+        work = [root]
+        while work:
+            item = work.pop()
+            if type(item) is tuple:
+                node = item[0]
+                if isinstance(node, BinaryOperatorNode):
+                    right = results.pop()
+                    left = results[-1]
+                    operator_type = node.operator_token.type
+                    if operator_type == Token.TT_PLUS:
+                        value = left + right
+                    elif operator_type == Token.TT_MINUS:
+                        value = left - right
+                    elif operator_type == Token.TT_MUL:
+                        value = left * right
+                    else:
+                        if right == 0:
+                            raise StarxlyException(RunTimeError(node.right_node.position_start, node.right_node.position_end, 'Division by zero', context))
+                        value = left / right
+                else:
+                    value = results[-1] * -1 if node.operator_token.type == Token.TT_MINUS else results[-1]
+                results[-1] = value
+                new_values[node] = value
+            elif item in values:
+                value = values[item]
+                results.append(value)
+                new_values[item] = value
+            elif isinstance(item, NumberNode):
+                results.append(item.token.value)
+            elif isinstance(item, BinaryOperatorNode):
+                work.append((item,))
+                work.append(item.right_node)
+                work.append(item.left_node)
+            else:
+                work.append((item,))
+                work.append(item.node)
+        return Number(results[0]).set_context(context).set_position(root.position_start, root.position_end)
@@ -0,0 +1,107 @@
+"""
+This script measures how many bytes each AST node costs when a
+parsed program is kept in memory, for node and token objects with a
+__dict__ as they were before __slots__, for the slotted node objects
+built by StackParser and for the array backed FlatTree.
+"""
+import gc
+import random
+import sys
+import tracemalloc
+import starxly
+
+def generate_expression(terms, seed=0):
+    """Generates a reproducible expression mixing ints, floats, unary minus and parentheses"""
+    random_generator = random.Random(seed)
+    parts = []
+    for i in range(terms):
+        if random_generator.random() < 0.7:
+            number = str(random_generator.randint(0, 100000))
+        else:
+            number = '{:.3f}'.format(random_generator.random() * 1000)
+        if random_generator.random() < 0.2:
+            number = '-' + number
+        if random_generator.random() < 0.1:
+            number = '(' + number + ' * 2)'
+        if i:
+            parts.append(random_generator.choice('+-*/'))
+        parts.append(number)
+    return ' '.join(parts)
+
+class DictToken:
+    """OffsetToken with a __dict__ instead of __slots__"""
+    def __init__(self, token):
+        self.type = token.type
+        self.value = token.value
+        self.start = token.start
+        self.end = token.end
+        self.source = token.source
+
+class DictNumberNode:
+    """NumberNode with a __dict__ and stored boundary tokens, as before __slots__"""
+    def __init__(self, token):
+        self.token = token
+        self.start_token = token
+        self.end_token = token
+
+class DictBinaryOperatorNode:
+    """BinaryOperatorNode with a __dict__"""
+    def __init__(self, left_node, operator_token, right_node):
+        self.left_node = left_node
+        self.operator_token = operator_token
+        self.right_node = right_node
+        self.start_token = left_node.start_token
+        self.end_token = right_node.end_token
+
+class DictUnaryOperatorNode:
+    """UnaryOperatorNode with a __dict__ and stored boundary tokens"""
+    def __init__(self, operator_token, node):
+        self.operator_token = operator_token
+        self.node = node
+        self.start_token = operator_token
+        self.end_token = node.end_token
+
+class DictStackParser(starxly.StackParser):
+    """StackParser building the __dict__ node classes from __dict__ copies of the tokens"""
+    def __init__(self, tokens):
+        super().__init__([DictToken(token) for token in tokens])
+        self.make_number = DictNumberNode
+        self.make_binary = DictBinaryOperatorNode
+        self.make_unary = DictUnaryOperatorNode
+
+def count_nodes(node):
+    """Counts the nodes of an object AST without recursing"""
+    count = 0
+    work = [node]
+    while work:
+        node = work.pop()
+        count += 1
+        if isinstance(node, (starxly.BinaryOperatorNode, DictBinaryOperatorNode)):
+            work.append(node.left_node)
+            work.append(node.right_node)
+        elif isinstance(node, (starxly.UnaryOperatorNode, DictUnaryOperatorNode)):
+            work.append(node.node)
+    return count
+
+def measure(parser_class, text):
+    """Returns (nodes, bytes retained by the parsed program) for the given parser"""
+    gc.collect()
+    tracemalloc.start()
+    tokens, error = starxly.RegexLexer('<memory>', text).tokenize()
+    result = parser_class(tokens).parse()
+    del tokens
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tree = result.node
+    nodes = len(tree) if isinstance(tree, starxly.FlatTree) else count_nodes(tree)
+    return nodes, retained
+
+def main(terms=100000):
+    text = generate_expression(terms)
+    for name, parser_class in (('__dict__ objects', DictStackParser), ('slotted objects', starxly.StackParser), ('flat arrays', starxly.FlatStackParser)):
+        nodes, retained = measure(parser_class, text)
+        print('{:<16} {:>9} nodes {:>12} bytes {:>8.1f} bytes/node'.format(name, nodes, retained, retained / nodes))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
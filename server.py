@@ -0,0 +1,232 @@
+"""
+This module serves starxly over TCP or a Unix socket with asyncio
+and provides a matching client. Each line sent to the server is
+one request, either a plain expression or a JSON object such as
+{"id": 1, "text": "1 + 2", "filename": "<stdin>"}. Every request
+gets one JSON line back, in the order the requests were sent:
+{"id": 1, "value": 3} or {"id": 1, "error": "<error text>"}, where
+the error text is exactly what the starxly Error would print.
+
+Requests on a connection are pipelined: they are read and handed
+to a thread or process pool while earlier ones are still running.
+At most max_pending requests per connection are in flight, after
+that the server stops reading until responses have been written.
+"""
+import argparse
+import asyncio
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import starxly
+
+DEFAULT_FILENAME = '<stdin>'
+LINE_LIMIT = 2 ** 24 # Longest request or response line in bytes
+
+def evaluate(filename, text):
+    """Runs text and returns (value, error text), both picklable so this can run in a worker process"""
+    value, error = starxly.run(filename, text)
+    if error:
+        return None, str(error)
+    return value.value, None
+
+def parse_request(line):
+    """Returns (request id, filename, text) for a JSON request or a plain expression line"""
+    line = line.decode('utf-8').rstrip('\r\n')
+    if line.startswith('{'):
+        request = json.loads(line)
+        return request.get('id'), request.get('filename', DEFAULT_FILENAME), request['text']
+    return None, DEFAULT_FILENAME, line
+
+def format_response(request_id, value, error):
+    """Encodes a response as a JSON line"""
+    response = {} if request_id is None else {'id': request_id}
+    if error is None:
+        response['value'] = value
+    else:
+        response['error'] = error
+    return (json.dumps(response) + '\n').encode('utf-8')
+
+def create_executor(kind='thread', workers=None):
+    """Creates the pool evaluation is offloaded to, kind is 'thread' or 'process'"""
+    if kind == 'process':
+        return ProcessPoolExecutor(max_workers=workers)
+    if kind == 'thread':
+        return ThreadPoolExecutor(max_workers=workers)
+    raise ValueError("Executor kind must be 'thread' or 'process', not {!r}".format(kind))
+
+class Server:
+    """
+    Evaluation server. Requests are run on executor, a timeout in
+    seconds is counted from when a request is read and applies to
+    each request separately.
+    """
+    def __init__(self, executor=None, timeout=None, max_pending=256):
+        self.executor = executor or create_executor()
+        self.timeout = timeout
+        self.max_pending = max_pending
+
+    async def start(self, host='127.0.0.1', port=8765, unix_path=None):
+        """Starts listening and returns the asyncio server"""
+        if unix_path:
+            return await asyncio.start_unix_server(self.handle_connection, unix_path, limit=LINE_LIMIT)
+        return await asyncio.start_server(self.handle_connection, host, port, limit=LINE_LIMIT)
+
+    async def handle_connection(self, reader, writer):
+        """Reads requests from a connection and queues them for the responder"""
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue(self.max_pending) # Full queue stops reading, which pushes back on the client
+        responder = asyncio.ensure_future(self.respond(pending, writer))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    break # Connection dropped or line longer than LINE_LIMIT
+                if not line:
+                    break
+                deadline = loop.time() + self.timeout if self.timeout is not None else None
+                try:
+                    request_id, filename, text = parse_request(line)
+                except (ValueError, KeyError, TypeError, AttributeError) as exception:
+                    future = loop.create_future()
+                    future.set_result((None, 'Invalid request: {}'.format(exception)))
+                    request_id = None
+                else:
+                    future = loop.run_in_executor(self.executor, evaluate, filename, text)
+                await pending.put((request_id, future, deadline))
+            await pending.put(None)
+            await responder
+        except asyncio.CancelledError:
+            # Server is shutting down, the connection task is the outermost task so it just stops
+            responder.cancel()
+        finally:
+            writer.close()
+
+    async def respond(self, pending, writer):
+        """Writes responses in request order as their evaluations finish"""
+        loop = asyncio.get_running_loop()
+        connected = True
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            request_id, future, deadline = item
+            if not connected:
+                future.cancel()
+                continue
+            try:
+                if deadline is None:
+                    value, error = await future
+                else:
+                    value, error = await asyncio.wait_for(future, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                value, error = None, 'Timeout: evaluation took longer than {} seconds'.format(self.timeout)
+            except Exception as exception:
+                value, error = None, 'Internal error: {!r}'.format(exception)
+            try:
+                writer.write(format_response(request_id, value, error))
+                await writer.drain()
+            except ConnectionError:
+                connected = False # Keep emptying the queue so the reader is never left blocked
+
+class Client:
+    """
+    Client for the evaluation server. Any number of requests can be in
+    flight on one connection, responses are matched to requests by
+    order. Results are (value, error text) pairs with value a plain
+    int or float.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = deque()
+        self.closed = False # Set once no more responses can arrive
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=8765, unix_path=None):
+        """Opens a connection to a server over TCP, or over a Unix socket if unix_path is given"""
+        if unix_path:
+            reader, writer = await asyncio.open_unix_connection(unix_path, limit=LINE_LIMIT)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        return cls(reader, writer)
+
+    async def receive(self):
+        """Hands each response line to the oldest request still waiting for one"""
+        try:
+            while True:
+                try:
+                    line = await self.reader.readline()
+                except (ConnectionError, ValueError):
+                    break # Connection dropped or line longer than LINE_LIMIT
+                if not line:
+                    break
+                if not self.waiting:
+                    break # Response to nothing, the stream can no longer be matched to requests
+                response = json.loads(line)
+                future = self.waiting.popleft()
+                if not future.cancelled():
+                    future.set_result((response.get('value'), response.get('error')))
+        finally:
+            self.closed = True
+            while self.waiting:
+                future = self.waiting.popleft()
+                if not future.cancelled():
+                    future.set_exception(ConnectionError('Connection closed before a response arrived'))
+
+    async def evaluate_many(self, texts, filename=None):
+        """Sends texts as one batch and returns their (value, error text) pairs in order"""
+        if self.closed or self.receiver.done():
+            raise ConnectionError('Connection is closed')
+        loop = asyncio.get_running_loop()
+        lines = []
+        futures = []
+        for text in texts:
+            request = {'text': text} if filename is None else {'text': text, 'filename': filename}
+            lines.append((json.dumps(request) + '\n').encode('utf-8'))
+            future = loop.create_future()
+            self.waiting.append(future)
+            futures.append(future)
+        self.writer.writelines(lines)
+        await self.writer.drain()
+        return await asyncio.gather(*futures)
+
+    async def evaluate(self, text, filename=None):
+        """Sends a single text and returns its (value, error text) pair"""
+        return (await self.evaluate_many([text], filename))[0]
+
+    async def close(self):
+        """Closes the connection"""
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+async def serve_forever(server, host, port, unix_path):
+    """Starts server and runs it until cancelled"""
+    listener = await server.start(host, port, unix_path)
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Serve starxly evaluation over TCP or a Unix socket')
+    argument_parser.add_argument('--host', default='127.0.0.1')
+    argument_parser.add_argument('--port', type=int, default=8765)
+    argument_parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead of TCP')
+    argument_parser.add_argument('--executor', choices=('thread', 'process'), default='thread', help='pool evaluation is offloaded to')
+    argument_parser.add_argument('--workers', type=int, help='size of the pool')
+    argument_parser.add_argument('--timeout', type=float, help='seconds each request may take')
+    argument_parser.add_argument('--max-pending', type=int, default=256, help='requests in flight per connection before reading pauses')
+    arguments = argument_parser.parse_args()
+
+    executor = create_executor(arguments.executor, arguments.workers)
+    server = Server(executor, arguments.timeout, arguments.max_pending)
+    try:
+        asyncio.run(serve_forever(server, arguments.host, arguments.port, arguments.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,25 @@
 """
 This script reads in raw input from terminal and displays
-it to treminal window
+it to treminal window. Given a file path (or - for stdin)
+it runs every line of it instead and prints the results.
+Interactive input is run in an IncrementalSession, so a line
+that only differs a little from the previous one is cheap.
 """
+import sys
 import starxly
+from incremental import IncrementalSession
 
+if len(sys.argv) > 1:
+    results = starxly.run_stream(sys.stdin) if sys.argv[1] == '-' else starxly.run_file(sys.argv[1])
+    for line_number, value, error in results:
+        print(error if error else value)
+    sys.exit()
+
+session = IncrementalSession('<stdin>')
 while True:
     text = input('starxly > ')
-    tokenized_text, error = starxly.run('<stdin>', text)
+    tokenized_text, error = session.update(text)
     if error:
         print(error)
     else:
-        print(tokenized_text)
\ No newline at end of file
+        print(tokenized_text)
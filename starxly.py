@@ -2,7 +2,19 @@
 This source file contains all the code for the starxly
 programming language which is based on BASIC.
 """
-from errorindicators import indicate_error
+import operator
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from itertools import islice
+from bisect import bisect_right
+from errorindicators import find_line_starts, indicate_error
 
 class Error:
     """Defining our own custom error class"""
@@ -15,9 +27,14 @@ class Error:
     def __str__(self):
         result = '{}:{}\n'.format(self.error_name, self.details)
         result += 'File {}, Line {}\n'.format(self.position_start.filename, self.position_start.line_number)
-        result += indicate_error(self.position_start.filetext, self.position_start, self.position_end)
+        result += indicate_error(self.position_start.filetext, self.position_start, self.position_end, self.position_start.line_starts)
         return result
 
+    def memory_size(self):
+        """Returns an estimate of the bytes held by the error, its positions and its details"""
+        getsizeof = sys.getsizeof
+        return getsizeof(self) + getsizeof(self.__dict__) + getsizeof(self.position_start) + getsizeof(self.position_end) + getsizeof(self.position_start.line_starts) + getsizeof(self.details)
+
 class IllegalCharacterError(Error):
     """Defining error representing when lexer comes across character it does not support"""
     def __init__(self, position_start, position_end, details):
@@ -37,7 +54,7 @@ class RunTimeError(Error):
     def __str__(self):
         result = self.generate_traceback()
         result += '{}:{}\n'.format(self.error_name, self.details)
-        result += indicate_error(self.position_start.filetext, self.position_start, self.position_end)
+        result += indicate_error(self.position_start.filetext, self.position_start, self.position_end, self.position_start.line_starts)
         return result
 
     def generate_traceback(self):
@@ -50,14 +67,27 @@ class RunTimeError(Error):
             context = context.parent
         return 'Traceback (most recent call last):\n' + result    
 
+class StarxlyException(Exception):
+    """
+    Raised internally by the fast path parser and evaluator to carry
+    an Error out of the loop that found it. Errors are rare so raising
+    is cheaper than wrapping every result. It never escapes run.
+    """
+    def __init__(self, error):
+        super().__init__(error.details)
+        self.error = error
+
 class Position:
     """Class representing our current location in the starxly source file"""
-    def __init__(self, index, line_number, column_number, filename, filetext):
+    __slots__ = ('index', 'line_number', 'column_number', 'filename', 'filetext', 'line_starts')
+
+    def __init__(self, index, line_number, column_number, filename, filetext, line_starts=None):
         self.index = index
         self.line_number = line_number
         self.column_number = column_number
         self.filename = filename
         self.filetext = filetext
+        self.line_starts = line_starts # Offsets of line starts in filetext when already known, shared by every position in it
 
     def advance(self, current_character=None):
         """Moves onto next index and updates line and column number if necessary"""
@@ -70,7 +100,30 @@ class Position:
 
     def copy(self):
         """Returns a copy of the current position in the starxly source file"""
-        return Position(self.index, self.line_number, self.column_number, self.filename, self.filetext)
+        return Position(self.index, self.line_number, self.column_number, self.filename, self.filetext, self.line_starts)
+
+class SourceText:
+    """
+    Starxly source file shared by all the tokens lexed from it.
+    Tokens only store integer offsets into the text, a Position
+    is built from an offset when an error actually needs one.
+    The line start table is built the first time it is needed and
+    shared by every Position and Error for the text.
+    """
+    __slots__ = ('filename', 'text', 'line_number', 'line_starts')
+
+    def __init__(self, filename, text, line_number=0):
+        self.filename = filename
+        self.text = text
+        self.line_number = line_number # Line of the file the text starts on
+        self.line_starts = None
+
+    def position(self, index):
+        """Builds the Position the character based lexer would have reached at index"""
+        if self.line_starts is None:
+            self.line_starts = find_line_starts(self.text)
+        line = bisect_right(self.line_starts, index) - 1
+        return Position(index, self.line_number + line, index - self.line_starts[line], self.filename, self.text, self.line_starts)
 
 class Token:
     """
@@ -88,6 +141,7 @@ class Token:
     TT_RPAREN = 'TT_RPAREN'
     TT_EOF = 'TT_EOF'
     DIGITS = '0123456789'
+    __slots__ = ('type', 'value', 'position_start', 'position_end')
 
     def __init__(self, type, value=None, position_start=None, position_end=None):
         """Method to initialize Token object"""
@@ -105,6 +159,29 @@ class Token:
         """Method to provide string representation of Token object. __str__ produces class name when called with list of objects, interesting..."""
         return '{}:{}'.format(self.type, self.value) if self.value else '{}'.format(self.type)
 
+class OffsetToken:
+    """
+    Token which stores its location as integer offsets into the
+    source text. Positions are only built when they are asked for.
+    """
+    __slots__ = ('type', 'value', 'start', 'end', 'source')
+    __repr__ = Token.__repr__
+
+    def __init__(self, type, value, start, end, source):
+        self.type = type
+        self.value = value
+        self.start = start
+        self.end = end
+        self.source = source
+
+    @property
+    def position_start(self):
+        return self.source.position(self.start)
+
+    @property
+    def position_end(self):
+        return self.source.position(self.end)
+
 class Lexer:
     """
     Lexer will go through input character by character and
@@ -174,35 +251,124 @@ class Lexer:
             self.advance()
         return Token(Token.TT_INT, int(numberstring), position_start, self.position) if not is_decimal_point else Token(Token.TT_FLOAT, float(numberstring), position_start, self.position)
 
+class RegexLexer:
+    """
+    Lexer which scans the whole text with a single compiled regular
+    expression instead of going through it character by character.
+    Produces the same tokens and errors as Lexer, but the tokens are
+    OffsetTokens so no Position is built unless an error needs it.
+    """
+    TOKEN_REGEX = re.compile(r'([ \t]+)|([0-9]+(?:\.[0-9]*)?)|(\+)|(-)|(\*)|(/)|(\()|(\))|(.)', re.DOTALL)
+    # Token type for each group of TOKEN_REGEX, None for groups that are handled separately
+    GROUP_TYPES = (None, None, None, Token.TT_PLUS, Token.TT_MINUS, Token.TT_MUL, Token.TT_DIV, Token.TT_LPAREN, Token.TT_RPAREN, None)
+    WHITESPACE_GROUP = 1
+    NUMBER_GROUP = 2
+    ILLEGAL_GROUP = 9
+
+    def __init__(self, filename, text, line_number=0):
+        """Initializes RegexLexer object, line_number is the line of the file text starts on"""
+        self.filename = filename
+        self.text = text
+        self.source = SourceText(filename, text, line_number)
+
+    def tokenize(self, start=0, end=None, source=None):
+        """
+        Tokenizes text in lexer. Given an end only text[start:end] is
+        tokenized and no end of file token is added, tokens refer to
+        source instead of the lexer's own SourceText if one is given.
+        """
+        tokens = []
+        append = tokens.append
+        source = source or self.source
+        group_types = self.GROUP_TYPES
+        for match in self.TOKEN_REGEX.finditer(self.text, start, len(self.text) if end is None else end):
+            group = match.lastindex
+            if group == self.WHITESPACE_GROUP:
+                continue
+            token_start, token_end = match.span()
+            if group == self.NUMBER_GROUP:
+                numberstring = match.group()
+                if '.' in numberstring:
+                    append(OffsetToken(Token.TT_FLOAT, float(numberstring), token_start, token_end, source))
+                else:
+                    append(OffsetToken(Token.TT_INT, int(numberstring), token_start, token_end, source))
+            elif group == self.ILLEGAL_GROUP:
+                return [], IllegalCharacterError(source.position(token_start), source.position(token_end), "'" + match.group() + "'")
+            else:
+                append(OffsetToken(group_types[group], None, token_start, token_end, source))
+        if end is None:
+            end_of_file = len(self.text)
+            append(OffsetToken(Token.TT_EOF, None, end_of_file, end_of_file + 1, source))
+        return tokens, None
+
 class NumberNode:
     """Node in AST representing a number"""
+    __slots__ = ('token',)
+
     def __init__(self, token):
         self.token = token
-        self.position_start = self.token.position_start
-        self.position_end = self.token.position_end
+
+    @property
+    def start_token(self):
+        return self.token
+
+    @property
+    def end_token(self):
+        return self.token
+
+    @property
+    def position_start(self):
+        return self.start_token.position_start
+
+    @property
+    def position_end(self):
+        return self.end_token.position_end
 
     def __repr__(self):
         return '{}'.format(self.token)
 
 class BinaryOperatorNode:
     """Node in AST representing binary operator"""
+    __slots__ = ('left_node', 'operator_token', 'right_node', 'start_token', 'end_token')
+
     def __init__(self, left_node, operator_token, right_node):
         self.left_node = left_node
         self.operator_token = operator_token
         self.right_node = right_node
-        self.position_start = self.left_node.position_start
-        self.position_end = self.right_node.position_end
+        self.start_token = self.left_node.start_token
+        self.end_token = self.right_node.end_token
+
+    @property
+    def position_start(self):
+        return self.start_token.position_start
+
+    @property
+    def position_end(self):
+        return self.end_token.position_end
 
     def __repr__(self):
         return '({}, {}, {})'.format(self.left_node, self.operator_token, self.right_node)
 
 class UnaryOperatorNode:
     """Node in AST represtning unary operator"""
+    __slots__ = ('operator_token', 'node', 'end_token')
+
     def __init__(self, operator_token, node):
         self.operator_token = operator_token
         self.node = node
-        self.position_start = self.operator_token.position_start
-        self.position_end = self.node.position_end
+        self.end_token = self.node.end_token
+
+    @property
+    def start_token(self):
+        return self.operator_token
+
+    @property
+    def position_start(self):
+        return self.start_token.position_start
+
+    @property
+    def position_end(self):
+        return self.end_token.position_end
 
     def __repr__(self):
         return '({}, {})'.format(self.operator_token, self.node)
@@ -325,6 +491,241 @@ class Parser:
             return result.success(left.node)
         return result.success(left)
 
+class PrecedenceClimber:
+    """
+    Precedence climbing state machine behind StackParser and Engine.
+    Tokens are fed in one at a time by type and operands are whatever
+    the make_number, make_binary and make_unary callbacks return, so
+    the same steps build an AST or compute a value directly. Pending
+    operators and open parentheses are kept on an explicit stack
+    instead of recursing once per grammar level and parenthesis.
+    """
+    # Static (Class) Variables: Precedence of entries on the operator stack
+    PAREN = 0
+    UNARY = 3
+    PRECEDENCE = {Token.TT_PLUS: 1, Token.TT_MINUS: 1, Token.TT_MUL: 2, Token.TT_DIV: 2}
+
+    def __init__(self, make_number, make_binary, make_unary, syntax_error):
+        self.make_number = make_number
+        self.make_binary = make_binary
+        self.make_unary = make_unary
+        self.syntax_error = syntax_error # Called with the token and the details on invalid syntax, has to raise
+        self.operands = []
+        self.operators = []
+        self.precedences = [] # Parallel to operators so unary, binary and parentheses can be told apart
+        self.expect_operand = True
+
+    def reset(self):
+        """Empties the stacks so a new expression can be fed in"""
+        self.operands.clear()
+        self.operators.clear()
+        self.precedences.clear()
+        self.expect_operand = True
+
+    def feed(self, token_type, token):
+        """Takes the next token, returning the root operand once it is the end of file and None before that"""
+        operands = self.operands
+        precedences = self.precedences
+        if self.expect_operand:
+            if token_type == Token.TT_INT or token_type == Token.TT_FLOAT:
+                operands.append(self.make_number(token))
+                self.reduce_unary()
+                self.expect_operand = False
+            elif token_type == Token.TT_PLUS or token_type == Token.TT_MINUS:
+                self.operators.append(token)
+                precedences.append(self.UNARY)
+            elif token_type == Token.TT_LPAREN:
+                self.operators.append(token)
+                precedences.append(self.PAREN)
+            else:
+                self.syntax_error(token, 'Expected int of float')
+        elif token_type in self.PRECEDENCE:
+            precedence = self.PRECEDENCE[token_type]
+            self.reduce_binary(precedence)
+            self.operators.append(token)
+            precedences.append(precedence)
+            self.expect_operand = True
+        else:
+            # Operand is complete, close the innermost parenthesis or the whole expression
+            self.reduce_binary(1)
+            if precedences:
+                if token_type != Token.TT_RPAREN:
+                    self.syntax_error(token, "Expected ')'")
+                self.operators.pop()
+                precedences.pop()
+                self.reduce_unary()
+            elif token_type != Token.TT_EOF:
+                self.syntax_error(token, "Expected '+', '-', '*' or '/'")
+            else:
+                return operands[0]
+        return None
+
+    def reduce_binary(self, minimum_precedence):
+        """Combines operands using the binary operators on top of the stack that bind at least as tightly as minimum_precedence"""
+        operands = self.operands
+        operators = self.operators
+        precedences = self.precedences
+        while precedences and precedences[-1] >= minimum_precedence:
+            precedences.pop()
+            right = operands.pop()
+            operands[-1] = self.make_binary(operands[-1], operators.pop(), right)
+
+    def reduce_unary(self):
+        """Applies the unary operators waiting on the operand that was just completed"""
+        operands = self.operands
+        operators = self.operators
+        precedences = self.precedences
+        while precedences and precedences[-1] == self.UNARY:
+            precedences.pop()
+            operands[-1] = self.make_unary(operators.pop(), operands[-1])
+
+class StackParser:
+    """
+    Parser which accepts the same grammar and builds the same AST as
+    Parser by feeding the tokens to a PrecedenceClimber, so nesting
+    depth is only limited by memory and no ParseResult is created per
+    node.
+    """
+    # Static (Class) Variables: Precedence of entries on the operator stack
+    PAREN = PrecedenceClimber.PAREN
+    UNARY = PrecedenceClimber.UNARY
+    PRECEDENCE = PrecedenceClimber.PRECEDENCE
+
+    def __init__(self, tokens, tracer=None):
+        self.tokens = tokens
+        # Node constructors, replaced by FlatStackParser to build a FlatTree instead
+        self.make_number = NumberNode
+        self.make_binary = BinaryOperatorNode
+        self.make_unary = UnaryOperatorNode
+        if tracer and tracer.callback:
+            self.trace_nodes(tracer)
+
+    def trace_nodes(self, tracer):
+        """Wraps the node constructors so every node built is reported to tracer"""
+        def traced(make_node):
+            def make_traced_node(*arguments):
+                node = make_node(*arguments)
+                tracer.node('parse', node)
+                return node
+            return make_traced_node
+        self.make_number = traced(self.make_number)
+        self.make_binary = traced(self.make_binary)
+        self.make_unary = traced(self.make_unary)
+
+    def parse(self):
+        """Parses the tokens into an AST, returning a ParseResult"""
+        try:
+            return ParseResult().success(self.build())
+        except StarxlyException as exception:
+            return ParseResult().failure(exception.error)
+
+    def build(self):
+        """Parses the tokens into an AST and returns its root, raising StarxlyException on invalid syntax"""
+        feed = PrecedenceClimber(self.make_number, self.make_binary, self.make_unary, self.syntax_error).feed
+        for token in self.tokens:
+            root = feed(token.type, token)
+            if root is not None:
+                return root
+
+    @staticmethod
+    def syntax_error(token, details):
+        raise StarxlyException(InvalidSyntaxError(token.position_start, token.position_end, details))
+
+class FlatTree:
+    """
+    Array backed AST. Each node is a row in parallel typed columns and
+    children are referred to by row index, so a node costs a few dozen
+    bytes instead of several Python objects. Integers too large for a
+    64 bit column and all positions are kept out of the columns, the
+    node span is stored as offsets into the shared SourceText.
+    """
+    # Static (Class) Variables: Node kinds
+    KIND_INT = 0
+    KIND_FLOAT = 1
+    KIND_BIG_INT = 2
+    KIND_BINARY = 3
+    KIND_UNARY = 4
+    OPERATORS = (None, Token.TT_PLUS, Token.TT_MINUS, Token.TT_MUL, Token.TT_DIV)
+    OPERATOR_CODES = {token_type: code for code, token_type in enumerate(OPERATORS)}
+    INT_MIN = -2 ** 63
+    INT_MAX = 2 ** 63 - 1
+
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('b')
+        self.operators = array('b')
+        self.left = array('q') # Left child, only child of unary nodes, or the value of int nodes
+        self.right = array('q')
+        self.floats = array('d')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.big_ints = []
+        self.root = -1
+
+    def add_row(self, kind, operator, left, right, value, start, end):
+        """Appends a node to every column and returns its index"""
+        self.kinds.append(kind)
+        self.operators.append(operator)
+        self.left.append(left)
+        self.right.append(right)
+        self.floats.append(value)
+        self.starts.append(start)
+        self.ends.append(end)
+        return len(self.kinds) - 1
+
+    def add_number(self, token):
+        if token.type == Token.TT_FLOAT:
+            return self.add_row(self.KIND_FLOAT, 0, 0, 0, token.value, token.start, token.end)
+        if self.INT_MIN <= token.value <= self.INT_MAX:
+            return self.add_row(self.KIND_INT, 0, token.value, 0, 0.0, token.start, token.end)
+        self.big_ints.append(token.value)
+        return self.add_row(self.KIND_BIG_INT, 0, len(self.big_ints) - 1, 0, 0.0, token.start, token.end)
+
+    def add_binary(self, left, operator_token, right):
+        return self.add_row(self.KIND_BINARY, self.OPERATOR_CODES[operator_token.type], left, right, 0.0, self.starts[left], self.ends[right])
+
+    def add_unary(self, operator_token, node):
+        return self.add_row(self.KIND_UNARY, self.OPERATOR_CODES[operator_token.type], node, 0, 0.0, operator_token.start, self.ends[node])
+
+    def value(self, index):
+        """Returns the constant held by a number node"""
+        kind = self.kinds[index]
+        if kind == self.KIND_INT:
+            return self.left[index]
+        if kind == self.KIND_FLOAT:
+            return self.floats[index]
+        return self.big_ints[self.left[index]]
+
+    def span(self, index):
+        """Returns an OffsetToken covering the source of a node, used where a node's positions are needed"""
+        return OffsetToken(None, None, self.starts[index], self.ends[index], self.source)
+
+    def memory_size(self):
+        """Returns the number of bytes held by the columns"""
+        columns = (self.kinds, self.operators, self.left, self.right, self.floats, self.starts, self.ends)
+        return sum(sys.getsizeof(column) for column in columns) + sys.getsizeof(self.big_ints)
+
+    def __len__(self):
+        return len(self.kinds)
+
+class FlatStackParser(StackParser):
+    """
+    StackParser which builds a FlatTree instead of node objects. Only
+    works on OffsetTokens, the ParseResult holds the FlatTree with its
+    root set.
+    """
+    def __init__(self, tokens):
+        super().__init__(tokens)
+        self.tree = FlatTree(tokens[-1].source)
+        self.make_number = self.tree.add_number
+        self.make_binary = self.tree.add_binary
+        self.make_unary = self.tree.add_unary
+
+    def build(self):
+        """Parses the tokens into a FlatTree and returns it, raising StarxlyException on invalid syntax"""
+        self.tree.root = super().build()
+        return self.tree
+
 class RunTimeResult:
     """Class to keep track of the current result and error if there is any"""
     def __init__(self):
@@ -346,6 +747,8 @@ class RunTimeResult:
     
 class Number:
     """Class for storing numbers and operating on them with other numbers"""
+    __slots__ = ('value', 'position_start', 'position_end', 'context')
+
     def __init__(self, value):
         self.value = value
         self.set_position()
@@ -394,6 +797,76 @@ class Context:
         self.parent = parent
         self.parent_entry_position = parent_entry_position
 
+class StageStats:
+    """Statistics gathered by a Tracer for one stage of the pipeline"""
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.count = 0 # Tokens for lex and parse, nodes for compile, instructions for execute, see compile_program for the optional stages
+        self.allocated_bytes = 0 # Memory still held when the stage finished
+        self.peak_bytes = 0 # Largest amount of memory held while the stage was running
+
+    def __repr__(self):
+        return 'StageStats(calls={}, seconds={:.6f}, count={}, allocated_bytes={}, peak_bytes={})'.format(self.calls, self.seconds, self.count, self.allocated_bytes, self.peak_bytes)
+
+class Tracer:
+    """
+    Collects wall time, item counts and optionally memory allocation
+    statistics for each stage of run and forwards per item events to
+    a callback, called as callback(stage, item) with:
+        'lex'      every token, in source order
+        'parse'    every node, as the parser builds it
+        'fold'     every node the ConstantFolder visits (optimize)
+        'compile'  every node the Compiler visits
+        'execute'  every (opcode, operand) instruction as the virtual
+                   machine runs it, or the closure (optimize)
+        'interpret' every node the legacy Interpreter visits
+    Execute events are sent for programs taken from a ProgramCache too.
+    Stages only check for a tracer when one is passed in, so tracing
+    costs nothing when it is disabled.
+    """
+    def __init__(self, callback=None, track_allocations=False):
+        self.callback = callback
+        self.track_allocations = track_allocations
+        self.stats = {}
+        self.started = {}
+
+    def begin(self, stage):
+        """Marks the start of a stage"""
+        if self.track_allocations:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.started[stage] = (time.perf_counter(), tracemalloc.get_traced_memory()[0], started_tracing)
+        else:
+            self.started[stage] = (time.perf_counter(), 0, False)
+
+    def end(self, stage, count=0):
+        """Marks the end of a stage and adds its statistics to the totals"""
+        started_at, memory_at_start, started_tracing = self.started.pop(stage)
+        stage_stats = self.stats.get(stage)
+        if stage_stats is None:
+            stage_stats = self.stats[stage] = StageStats()
+        stage_stats.calls += 1
+        stage_stats.seconds += time.perf_counter() - started_at
+        stage_stats.count += count
+        if self.track_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            stage_stats.allocated_bytes += current - memory_at_start
+            stage_stats.peak_bytes = max(stage_stats.peak_bytes, peak - memory_at_start)
+            if started_tracing:
+                # Tracing slows everything down, only keep it on while a stage is measured
+                tracemalloc.stop()
+
+    def node(self, stage, node):
+        """Reports a node to the callback"""
+        if self.callback:
+            self.callback(stage, node)
+
+    def reset(self):
+        """Clears the statistics gathered so far"""
+        self.stats = {}
 
 class Interpreter:
     """
@@ -401,6 +874,9 @@ class Interpreter:
     different node types and determines the code to be 
     executed.
     """
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+
     def visit(self, node, context):
         """Processes given node and visits all its cihldren"""
         method_name = 'visit_{}'.format(type(node).__name__)
@@ -412,11 +888,13 @@ class Interpreter:
         raise Exception('No visit_{} method defined'.format(type(node).__name__))
     
     def visit_NumberNode(self, node, context):
-        print('Found number node!')
+        if self.tracer:
+            self.tracer.node('interpret', node)
         return RunTimeResult().success(Number(node.token.value).set_context(context).set_position(node.position_start, node.position_end))
 
     def visit_BinaryOperatorNode(self, node, context):
-        print('Found binary operator node!')
+        if self.tracer:
+            self.tracer.node('interpret', node)
         response = RunTimeResult()
         left = response.register(self.visit(node.left_node, context))
         if response.error: 
@@ -436,7 +914,8 @@ class Interpreter:
         return response.failure(error) if error else response.success(result.set_position(node.position_start, node.position_end))
 
     def visit_UnaryOperatorNode(self, node, context):
-        print('Found unary operator node')
+        if self.tracer:
+            self.tracer.node('interpret', node)
         response = RunTimeResult()
         number = response.register(self.visit(node.node, context))
         if response.error:
@@ -446,21 +925,1021 @@ class Interpreter:
             number, error = number.multiply(Number(-1))
         return response.failure(error) if error else response.success(number.set_position(node.position_start, node.position_end))
 
-def run(filename, text):
-    """Function to run the lexer on some text"""
+# Operation each binary operator applies to plain Python numbers, the same as the Number methods
+BINARY_OPERATIONS = {
+    Token.TT_PLUS: operator.add,
+    Token.TT_MINUS: operator.sub,
+    Token.TT_MUL: operator.mul,
+    Token.TT_DIV: operator.truediv,
+}
+
+def binary_operation(operator_type, left, right):
+    """Applies a binary operator to two plain Python numbers, raising ZeroDivisionError where Number.divide reports division by zero"""
+    return BINARY_OPERATIONS[operator_type](left, right)
+
+class Bytecode:
+    """
+    Flat list of instructions produced by the compiler. Opcodes
+    and operands are stored in parallel lists so that the
+    virtual machine can step through them without touching
+    the AST again.
+    """
+    # Static (Class) Variables: Opcodes
+    OP_PUSH_CONST = 0
+    OP_ADD = 1
+    OP_SUB = 2
+    OP_MUL = 3
+    OP_DIV = 4 # Binary opcodes are OP_ADD to OP_DIV
+    OP_NEG = 5
+    OP_STORE = 6 # Copies the top of the stack into a slot
+    OP_LOAD = 7 # Pushes the value kept in a slot
+    # Bytes of a span, its tuple and the two tokens it refers to
+    SPAN_SIZE = sys.getsizeof((None, None)) + 2 * sys.getsizeof(OffsetToken(None, None, 0, 0, None))
+
+    def __init__(self, start_token=None, end_token=None):
+        self.opcodes = []
+        self.operands = []
+        self.constants = []
+        self.spans = [] # (start_token, end_token) of divisors so runtime errors point at the source
+        self.start_token = start_token
+        self.end_token = end_token
+        self.node_count = 0
+        self.slot_count = 0 # Slots holding the values of shared subexpressions
+        self.deduplicated = 0 # Nodes not compiled because an identical subtree was compiled earlier
+
+    def emit(self, opcode, operand=None):
+        """Appends an instruction to the bytecode"""
+        self.opcodes.append(opcode)
+        self.operands.append(operand)
+
+    def add_constant(self, value):
+        """Adds value to the constant pool and returns its index"""
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+    def add_span(self, start_token, end_token):
+        """Adds a source range to the span table and returns its index"""
+        self.spans.append((start_token, end_token))
+        return len(self.spans) - 1
+
+    def memory_size(self):
+        """Returns an estimate of the bytes held by the bytecode, its constants, its spans and the source they refer to"""
+        getsizeof = sys.getsizeof
+        size = getsizeof(self) + getsizeof(self.__dict__) + getsizeof(self.start_token.source)
+        size += getsizeof(self.opcodes) + getsizeof(self.operands) + getsizeof(self.constants) + getsizeof(self.spans)
+        size += sum(getsizeof(constant) for constant in self.constants)
+        size += sum(getsizeof(operand) for operand in self.operands if operand is not None and operand > 256) # Smaller ints are shared
+        return size + 2 * getsizeof(self.start_token) + len(self.spans) * self.SPAN_SIZE
+
+    def __repr__(self):
+        return '{}'.format(list(zip(self.opcodes, self.operands)))
+
+class Reassociator:
+    """
+    Optimizing stage which rebalances chains of the same operator, the
+    left deep trees the parser builds for 1 + 2 - 3 + 4, into trees of
+    depth O(log n). Operands keep their left to right order and signs
+    are carried over, so a - b + c - d becomes (a - b) + (c - d).
+    Chains are only reordered where that is exact: +, - and * between
+    operands that are ints, since division always produces a float.
+    With allow_inexact float chains and division chains are rebalanced
+    too, which can change rounding and which divisor a division by zero
+    error points at.
+    """
+    INVERSES = {Token.TT_PLUS: Token.TT_MINUS, Token.TT_MINUS: Token.TT_PLUS, Token.TT_MUL: Token.TT_DIV, Token.TT_DIV: Token.TT_MUL}
+    POSITIVE = (Token.TT_PLUS, Token.TT_MUL)
+
+    def __init__(self, allow_inexact=False):
+        self.allow_inexact = allow_inexact
+        self.chain_count = 0 # Chains that were rebalanced
+        # Operators which continue a chain down the left spine below an operator
+        additive = (Token.TT_PLUS, Token.TT_MINUS)
+        multiplicative = (Token.TT_MUL, Token.TT_DIV) if allow_inexact else (Token.TT_MUL,)
+        self.links = {Token.TT_PLUS: additive, Token.TT_MINUS: additive, Token.TT_MUL: multiplicative, Token.TT_DIV: multiplicative if allow_inexact else ()}
+
+    def reassociate(self, node):
+        """Returns the AST rooted at node with its chains rebalanced, walking it with an explicit work stack like Compiler"""
+        results = [] # (node, whether it always evaluates to an int)
+        work = [node]
+        while work:
+            item = work.pop()
+            if type(item) is tuple:
+                # Operands of the chain or unary operator have been rebalanced
+                node, operators, operands = item
+                if operators is None:
+                    child, is_int = results.pop()
+                    results.append((node if child is node.node else UnaryOperatorNode(node.operator_token, child), is_int))
+                else:
+                    results.append(self.rebuild(node, operators, operands, results))
+            elif isinstance(item, NumberNode):
+                results.append((item, item.token.type == Token.TT_INT))
+            elif isinstance(item, BinaryOperatorNode):
+                # Walk down the left spine collecting the operands of the chain
+                links = self.links[item.operator_token.type]
+                operators = [item.operator_token]
+                operands = [item.right_node]
+                spine = item.left_node
+                while isinstance(spine, BinaryOperatorNode) and spine.operator_token.type in links:
+                    operators.append(spine.operator_token)
+                    operands.append(spine.right_node)
+                    spine = spine.left_node
+                operands.append(spine)
+                work.append((item, operators[::-1], operands[::-1]))
+                work.extend(operands) # Leftmost operand is on top so results come out left to right
+            elif isinstance(item, UnaryOperatorNode):
+                work.append((item, None, None))
+                work.append(item.node)
+            else:
+                raise Exception('No reassociate method defined for {}'.format(type(item).__name__))
+        return results[0][0]
+
+    def rebuild(self, node, operators, original_operands, results):
+        """Builds the chain headed by node from its reassociated operands, which are popped from results"""
+        count = len(original_operands)
+        operands = results[-count:]
+        del results[-count:]
+        is_int = all(is_int for operand, is_int in operands) and not any(token.type == Token.TT_DIV for token in operators)
+        operands = [operand for operand, is_int in operands]
+        if count >= 3 and (is_int or self.allow_inexact):
+            self.chain_count += 1
+            signs = [True] + [token.type in self.POSITIVE for token in operators]
+            return self.balance(operands, operators, signs, 0, count - 1), is_int
+        if all(operand is original for operand, original in zip(operands, original_operands)):
+            return node, is_int
+        # Keep the chain in order, only its operands changed
+        spine = operands[0]
+        for index, token in enumerate(operators):
+            spine = BinaryOperatorNode(spine, token, operands[index + 1])
+        return spine, is_int
+
+    def balance(self, operands, operators, signs, low, high):
+        """Returns a balanced tree for operands[low:high + 1] with signs relative to the sign of operands[low]"""
+        if low == high:
+            return operands[low]
+        middle = (low + high + 1) // 2
+        token = operators[middle - 1]
+        if (signs[middle] == signs[low]) != (token.type in self.POSITIVE):
+            # Right half is combined with the inverse of the operator written before it
+            token = OffsetToken(self.INVERSES[token.type], None, token.start, token.end, token.source)
+        return BinaryOperatorNode(self.balance(operands, operators, signs, low, middle - 1), token, self.balance(operands, operators, signs, middle, high))
+
+class SubexpressionSharer:
+    """
+    Analysis stage which hash-conses the AST. Every node gets an id
+    keyed by its kind, operator and the ids of its children, so
+    structurally identical subtrees share one id and the tree can be
+    treated as a DAG. An operator subtree that occurs again after its
+    first occurrence in evaluation order is given a slot: the first
+    occurrence is evaluated and kept there, the repeats reuse it.
+    Evaluation order is unchanged, so a failing subtree still fails at
+    its first occurrence.
+    """
+    def __init__(self):
+        self.ids = {} # Node to the id of its structure
+        self.slots = {} # Id to slot for subtrees that are reused
+        self.deduplicated = 0 # Nodes in the repeats, which are never evaluated
+
+    def share(self, node):
+        """Finds the shared subtrees of the AST rooted at node, walking it with explicit work stacks like Compiler"""
+        ids = self.ids
+        keys = {}
+        sizes = [] # Node count of the subtree with each id
+        work = [node]
+        while work:
+            item = work.pop()
+            if type(item) is tuple:
+                item = item[0]
+                if isinstance(item, BinaryOperatorNode):
+                    key = (item.operator_token.type, ids[item.left_node], ids[item.right_node])
+                    size = sizes[key[1]] + sizes[key[2]] + 1
+                else:
+                    key = (item.operator_token.type, ids[item.node])
+                    size = sizes[key[1]] + 1
+            elif isinstance(item, NumberNode):
+                key = (item.token.type, item.token.value) # Token type keeps 1 and 1.0 apart
+                size = 1
+            elif isinstance(item, BinaryOperatorNode):
+                work.append((item,))
+                work.append(item.right_node)
+                work.append(item.left_node)
+                continue
+            elif isinstance(item, UnaryOperatorNode):
+                work.append((item,))
+                work.append(item.node)
+                continue
+            else:
+                raise Exception('No share method defined for {}'.format(type(item).__name__))
+            node_id = keys.get(key)
+            if node_id is None:
+                node_id = keys[key] = len(sizes)
+                sizes.append(size)
+            ids[item] = node_id
+        # Walk again in evaluation order without entering repeats, numbers are cheaper to push than to share
+        seen = set()
+        work = [node]
+        while work:
+            item = work.pop()
+            if isinstance(item, NumberNode):
+                continue
+            node_id = ids[item]
+            if node_id in seen:
+                if node_id not in self.slots:
+                    self.slots[node_id] = len(self.slots)
+                self.deduplicated += sizes[node_id]
+                continue
+            seen.add(node_id)
+            if isinstance(item, BinaryOperatorNode):
+                work.append(item.right_node)
+                work.append(item.left_node)
+            else:
+                work.append(item.node)
+        return self
+
+class Compiler:
+    """
+    The compiler flattens the AST produced by the parser into
+    bytecode. Operands are emitted before their operator so the
+    virtual machine only needs a value stack to run it.
+    """
+    BINARY_OPCODES = {
+        Token.TT_PLUS: Bytecode.OP_ADD,
+        Token.TT_MINUS: Bytecode.OP_SUB,
+        Token.TT_MUL: Bytecode.OP_MUL,
+        Token.TT_DIV: Bytecode.OP_DIV,
+    }
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+
+    def compile(self, node, sharer=None):
+        """
+        Compiles the AST rooted at node into bytecode. The tree is
+        walked with an explicit work stack holding nodes still to be
+        compiled and (opcode, operand) instructions waiting for their
+        operands, so deep trees never hit the recursion limit. Given a
+        SubexpressionSharer that has run on node, the first occurrence
+        of each shared subtree stores its value and repeats load it.
+        """
+        bytecode = Bytecode(node.start_token, node.end_token)
+        tracer = self.tracer if self.tracer and self.tracer.callback else None
+        slots = sharer.slots if sharer and sharer.slots else None
+        if slots:
+            ids = sharer.ids
+            stored = set()
+            bytecode.slot_count = len(slots)
+            bytecode.deduplicated = sharer.deduplicated
+        work = [node]
+        while work:
+            item = work.pop()
+            if type(item) is tuple:
+                bytecode.emit(*item)
+                continue
+            bytecode.node_count += 1
+            if tracer:
+                tracer.node('compile', item)
+            if slots:
+                slot = slots.get(ids[item])
+                if slot is not None:
+                    if slot in stored:
+                        bytecode.emit(Bytecode.OP_LOAD, slot)
+                        continue
+                    stored.add(slot)
+                    work.append((Bytecode.OP_STORE, slot))
+            if isinstance(item, NumberNode):
+                bytecode.emit(Bytecode.OP_PUSH_CONST, bytecode.add_constant(item.token.value))
+            elif isinstance(item, BinaryOperatorNode):
+                opcode = self.BINARY_OPCODES[item.operator_token.type]
+                if opcode == Bytecode.OP_DIV:
+                    work.append((opcode, bytecode.add_span(item.right_node.start_token, item.right_node.end_token)))
+                else:
+                    work.append((opcode, None))
+                work.append(item.right_node)
+                work.append(item.left_node)
+            elif isinstance(item, UnaryOperatorNode):
+                if item.operator_token.type == Token.TT_MINUS:
+                    work.append((Bytecode.OP_NEG, None))
+                work.append(item.node)
+            else:
+                raise Exception('No compile method defined for {}'.format(type(item).__name__))
+        return bytecode
+
+    def compile_flat(self, tree):
+        """Compiles a FlatTree into bytecode, walking its rows with an explicit work stack like compile"""
+        root_span = tree.span(tree.root)
+        bytecode = Bytecode(root_span, root_span)
+        kinds = tree.kinds
+        operators = tree.operators
+        left = tree.left
+        right = tree.right
+        work = [tree.root]
+        while work:
+            item = work.pop()
+            if type(item) is tuple:
+                bytecode.emit(*item)
+                continue
+            bytecode.node_count += 1
+            kind = kinds[item]
+            if kind == FlatTree.KIND_BINARY:
+                opcode = self.BINARY_OPCODES[FlatTree.OPERATORS[operators[item]]]
+                if opcode == Bytecode.OP_DIV:
+                    divisor = tree.span(right[item])
+                    work.append((opcode, bytecode.add_span(divisor, divisor)))
+                else:
+                    work.append((opcode, None))
+                work.append(right[item])
+                work.append(left[item])
+            elif kind == FlatTree.KIND_UNARY:
+                if FlatTree.OPERATORS[operators[item]] == Token.TT_MINUS:
+                    work.append((Bytecode.OP_NEG, None))
+                work.append(left[item])
+            else:
+                bytecode.emit(Bytecode.OP_PUSH_CONST, bytecode.add_constant(tree.value(item)))
+        return bytecode
+
+class VirtualMachine:
+    """
+    Stack based virtual machine which executes the bytecode
+    produced by the compiler. Values on the stack are plain
+    Python numbers, a Number is only created for the result.
+    """
+    # Operation each binary opcode applies, taken from BINARY_OPERATIONS so the VM and binary_operation agree
+    OPERATIONS = {opcode: BINARY_OPERATIONS[operator_type] for operator_type, opcode in Compiler.BINARY_OPCODES.items()}
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+
+    def execute(self, bytecode, context):
+        """Runs bytecode in the given context and returns a RunTimeResult"""
+        try:
+            return RunTimeResult().success(self.evaluate(bytecode, context))
+        except StarxlyException as exception:
+            return RunTimeResult().failure(exception.error)
+
+    def evaluate(self, bytecode, context):
+        """Runs bytecode in the given context and returns the resulting Number, raising StarxlyException on run time errors"""
+        return Number(self.evaluate_value(bytecode, context)).set_context(context).set_position(bytecode.start_token.position_start, bytecode.end_token.position_end)
+
+    def evaluate_value(self, bytecode, context):
+        """Runs bytecode like evaluate but returns the plain Python number"""
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        constants = bytecode.constants
+        slots = [None] * bytecode.slot_count
+        instructions = zip(bytecode.opcodes, bytecode.operands)
+        if self.tracer and self.tracer.callback:
+            instructions = self.traced(instructions)
+        operations = self.OPERATIONS
+        try:
+            for opcode, operand in instructions:
+                if opcode == Bytecode.OP_PUSH_CONST:
+                    push(constants[operand])
+                elif opcode <= Bytecode.OP_DIV:
+                    right = pop()
+                    stack[-1] = operations[opcode](stack[-1], right)
+                elif opcode == Bytecode.OP_NEG:
+                    stack[-1] = stack[-1] * -1 # Same as Number.multiply(Number(-1)) so -0.0 is preserved for floats
+                elif opcode == Bytecode.OP_STORE:
+                    slots[operand] = stack[-1]
+                elif opcode == Bytecode.OP_LOAD:
+                    push(slots[operand])
+        except ZeroDivisionError:
+            # Only OP_DIV raises it, its operand is the span of the divisor
+            start_token, end_token = bytecode.spans[operand]
+            raise StarxlyException(RunTimeError(start_token.position_start, end_token.position_end, 'Division by zero', context))
+        return stack[-1]
+
+    def traced(self, instructions):
+        """Yields the instructions, reporting each one to the tracer as it is about to run"""
+        for instruction in instructions:
+            self.tracer.node('execute', instruction)
+            yield instruction
+
+class ConstantNode:
+    """Node standing in for a subtree the ConstantFolder reduced to a single value"""
+    __slots__ = ('value', 'start_token', 'end_token')
+
+    def __init__(self, value, start_token, end_token):
+        self.value = value
+        self.start_token = start_token
+        self.end_token = end_token
+
+    @property
+    def position_start(self):
+        return self.start_token.position_start
+
+    @property
+    def position_end(self):
+        return self.end_token.position_end
+
+    def __repr__(self):
+        return '{}'.format(self.value)
+
+class DeferredOperationNode:
+    """
+    Node for a binary operation the ConstantFolder could not reduce
+    because it fails, either a division by zero or an int too large to
+    convert to float. It keeps the operands and the divisor span so the
+    failure happens at run time exactly as it would have.
+    """
+    __slots__ = ('operator_type', 'left_value', 'right_value', 'right_start_token', 'right_end_token', 'start_token', 'end_token')
+
+    def __init__(self, operator_type, left_value, right_value, right_node, node):
+        self.operator_type = operator_type
+        self.left_value = left_value
+        self.right_value = right_value
+        self.right_start_token = right_node.start_token
+        self.right_end_token = right_node.end_token
+        self.start_token = node.start_token
+        self.end_token = node.end_token
+
+    @property
+    def position_start(self):
+        return self.start_token.position_start
+
+    @property
+    def position_end(self):
+        return self.end_token.position_end
+
+    def __repr__(self):
+        return '({}, {}, {})'.format(self.left_value, self.operator_type, self.right_value)
+
+class ConstantFolder:
+    """
+    Optimizing stage which reduces the AST at compile time. Programs are
+    arithmetic over literals so every subtree folds into a ConstantNode
+    unless evaluating it fails. The first failing operation in evaluation
+    order becomes a DeferredOperationNode which replaces every subtree
+    containing it, since evaluation would always stop there.
+    """
+    OPERATIONS = BINARY_OPERATIONS
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+        self.node_count = 0
+
+    def fold(self, node, sharer=None):
+        """
+        Folds the AST rooted at node, walking it with an explicit work
+        stack like Compiler. Given a SubexpressionSharer that has run on
+        node, each shared subtree is folded once and repeats reuse it.
+        """
+        ids = sharer.ids if sharer and sharer.slots else None
+        tracer = self.tracer if self.tracer and self.tracer.callback else None
+        folded = {} # Id to the folded first occurrence of a shared subtree
+        results = []
+        work = [node]
+        while work:
+            item = work.pop()
+            if type(item) is tuple:
+                # Children of the node have been folded, now fold the node itself
+                item = item[0]
+                if isinstance(item, BinaryOperatorNode):
+                    right = results.pop()
+                    results[-1] = self.fold_binary(item, results[-1], right)
+                else:
+                    results[-1] = self.fold_unary(item, results[-1])
+                if ids:
+                    folded[ids[item]] = results[-1]
+                continue
+            if ids:
+                result = folded.get(ids[item])
+                if result is not None:
+                    results.append(result)
+                    continue
+            self.node_count += 1
+            if tracer:
+                tracer.node('fold', item)
+            if isinstance(item, NumberNode):
+                results.append(ConstantNode(item.token.value, item.token, item.token))
+            elif isinstance(item, BinaryOperatorNode):
+                work.append((item,))
+                work.append(item.right_node)
+                work.append(item.left_node)
+            elif isinstance(item, UnaryOperatorNode):
+                work.append((item,))
+                work.append(item.node)
+            else:
+                raise Exception('No fold method defined for {}'.format(type(item).__name__))
+        return results[0]
+
+    def fold_binary(self, node, left, right):
+        """Folds a binary operator node whose operands have already been folded"""
+        # The left operand is evaluated first so its failure wins
+        if isinstance(left, DeferredOperationNode):
+            return left
+        if isinstance(right, DeferredOperationNode):
+            return right
+        operator_type = node.operator_token.type
+        try:
+            value = binary_operation(operator_type, left.value, right.value)
+        except (ZeroDivisionError, OverflowError):
+            return DeferredOperationNode(operator_type, left.value, right.value, node.right_node, node)
+        return ConstantNode(value, node.start_token, node.end_token)
+
+    def fold_unary(self, node, operand):
+        """Folds a unary operator node whose operand has already been folded"""
+        if isinstance(operand, DeferredOperationNode):
+            return operand
+        value = operand.value * -1 if node.operator_token.type == Token.TT_MINUS else operand.value
+        return ConstantNode(value, node.start_token, node.end_token)
+
+class ClosureCompiler:
+    """
+    Backend which turns a folded AST into a Python closure taking the
+    run time Context and returning the resulting Number, or raising
+    StarxlyException like VirtualMachine.evaluate. Folding leaves at
+    most one operation to perform, so running the closure never walks
+    a tree.
+    """
+    def compile(self, node):
+        """Returns a closure evaluating the folded node"""
+        start_token = node.start_token
+        end_token = node.end_token
+        if isinstance(node, ConstantNode):
+            value = node.value
+            def program(context):
+                return Number(value).set_context(context).set_position(start_token.position_start, end_token.position_end)
+            return program
+        operator_type = node.operator_type
+        operation = ConstantFolder.OPERATIONS[operator_type]
+        left_value = node.left_value
+        right_value = node.right_value
+        right_start_token = node.right_start_token
+        right_end_token = node.right_end_token
+        def program(context):
+            if operator_type == Token.TT_DIV and right_value == 0:
+                raise StarxlyException(RunTimeError(right_start_token.position_start, right_end_token.position_end, 'Division by zero', context))
+            return Number(operation(left_value, right_value)).set_context(context).set_position(start_token.position_start, end_token.position_end)
+        return program
+
+    @staticmethod
+    def memory_size(program):
+        """Returns an estimate of the bytes held by a closure compile returned, its cells and the values and tokens they hold"""
+        getsizeof = sys.getsizeof
+        size = getsizeof(program) + getsizeof(program.__closure__)
+        sources = set()
+        for cell in program.__closure__:
+            contents = cell.cell_contents
+            size += getsizeof(cell)
+            if isinstance(contents, (int, float, OffsetToken)):
+                size += getsizeof(contents)
+            if isinstance(contents, OffsetToken):
+                sources.add(contents.source)
+        return size + sum(getsizeof(source) for source in sources)
+
+def compile_program(filename, text, tracer=None, line_number=0, optimize=False, share=False, reassociate=False):
+    """
+    Lexes, parses and compiles text, returning (program, error). The
+    program is bytecode for the VirtualMachine, or with optimize the
+    AST is constant folded and compiled to a closure instead. With
+    share identical subtrees are evaluated or folded only once, the
+    number of nodes skipped is the count of the 'share' stage. With
+    reassociate chains whose result cannot change are rebalanced,
+    reassociate='inexact' rebalances float and division chains too.
+    """
     # Generate tokens
-    lexer = Lexer(filename, text)
+    if tracer:
+        tracer.begin('lex')
+    lexer = RegexLexer(filename, text, line_number)
     tokens, error = lexer.tokenize()
+    if tracer:
+        tracer.end('lex', len(tokens))
     if error:
         return None, error
+    if tracer and tracer.callback:
+        for token in tokens:
+            tracer.node('lex', token)
     # Generate AST
-    parser = Parser(tokens)
-    abstract_syntax_tree = parser.parse()
-    if abstract_syntax_tree.error:
-        return None, abstract_syntax_tree.error
-    # Run program
-    interpreter = Interpreter()
+    if tracer:
+        tracer.begin('parse')
+    parser = StackParser(tokens, tracer)
+    try:
+        abstract_syntax_tree = parser.build()
+    except StarxlyException as exception:
+        error = exception.error
+    if tracer:
+        tracer.end('parse', len(tokens))
+    if error:
+        return None, error
+    if reassociate:
+        # Rebalance operator chains
+        if tracer:
+            tracer.begin('reassociate')
+        reassociator = Reassociator(reassociate == 'inexact')
+        abstract_syntax_tree = reassociator.reassociate(abstract_syntax_tree)
+        if tracer:
+            tracer.end('reassociate', reassociator.chain_count)
+    sharer = None
+    if share:
+        # Find identical subtrees
+        if tracer:
+            tracer.begin('share')
+        sharer = SubexpressionSharer().share(abstract_syntax_tree)
+        if tracer:
+            tracer.end('share', sharer.deduplicated)
+    if optimize:
+        # Fold constants and compile what is left to a closure
+        if tracer:
+            tracer.begin('compile')
+        folder = ConstantFolder(tracer)
+        program = ClosureCompiler().compile(folder.fold(abstract_syntax_tree, sharer))
+        if tracer:
+            tracer.end('compile', folder.node_count)
+        return program, None
+    # Compile AST to bytecode
+    if tracer:
+        tracer.begin('compile')
+    bytecode = Compiler(tracer).compile(abstract_syntax_tree, sharer)
+    if tracer:
+        tracer.end('compile', bytecode.node_count)
+    return bytecode, None
+
+class ProgramCache:
+    """
+    Size bounded least recently used cache of compiled programs keyed
+    by filename, source text and starting line. Lex and parse errors are cached too so
+    malformed programs arriving repeatedly are cheap to reject. Size is
+    measured in entries and in bytes held, estimated for each entry from
+    its source text and the objects of its program or error.
+    """
+    # Bytes of the key tuple and the two entry tuples of each entry, plus about 100 for its OrderedDict slot and link
+    ENTRY_OVERHEAD = sys.getsizeof((None,) * 6) + 2 * sys.getsizeof((None, None)) + 100
+
+    def __init__(self, max_entries=1024, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, filename, text, tracer=None, line_number=0, optimize=False, share=False, reassociate=False):
+        """Returns (program, error) for text, compiling it on a miss"""
+        key = (filename, text, line_number, optimize, share, reassociate)
+        cached = self.entries.get(key)
+        if cached is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return cached[0]
+        self.misses += 1
+        entry = compile_program(filename, text, tracer, line_number, optimize, share, reassociate)
+        size = self.ENTRY_OVERHEAD + sys.getsizeof(text) + self.estimate_size(*entry)
+        self.entries[key] = (entry, size)
+        self.size += size
+        self.evict()
+        return entry
+
+    @staticmethod
+    def estimate_size(program, error):
+        """Estimates the bytes held by a compiled program or by the error compiling it produced, each reports its own size"""
+        if error:
+            return error.memory_size()
+        if isinstance(program, Bytecode):
+            return program.memory_size()
+        return ClosureCompiler.memory_size(program)
+
+    def evict(self):
+        """Drops least recently used entries until the cache is within its limits"""
+        while self.entries and ((self.max_entries is not None and len(self.entries) > self.max_entries) or (self.max_bytes is not None and self.size > self.max_bytes)):
+            key, (entry, size) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Removes every entry, counters are kept"""
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """Returns hit, miss and eviction counts along with the current size"""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self.entries), 'bytes': self.size}
+
+    def __repr__(self):
+        return 'ProgramCache({})'.format(self.stats())
+
+def run(filename, text, cache=None, tracer=None, line_number=0, optimize=False, share=False, reassociate=False):
+    """
+    Function to run the lexer on some text, reusing compiled programs
+    from cache if one is given. Statistics for each stage are added to
+    tracer.stats if a Tracer is given. Errors report line numbers
+    counted from line_number, the line of the file text starts on.
+    With optimize the program is constant folded and run as a closure.
+    With share identical subexpressions are only evaluated once, with
+    reassociate operator chains are rebalanced (see compile_program).
+    """
+    if cache is not None:
+        program, error = cache.get(filename, text, tracer, line_number, optimize, share, reassociate)
+    else:
+        program, error = compile_program(filename, text, tracer, line_number, optimize, share, reassociate)
+    if error:
+        return None, error
+    return execute_program(program, tracer, optimize)
+
+def execute_program(program, tracer=None, optimize=False):
+    """Runs a program returned by compile_program in a new root context, returning (value, error)"""
+    if tracer:
+        tracer.begin('execute')
     context = Context('<program>') # Defining our initial root context
-    result = interpreter.visit(abstract_syntax_tree.node, context)
+    value = error = None
+    try:
+        if optimize:
+            if tracer:
+                tracer.node('execute', program)
+            value = program(context)
+        else:
+            value = VirtualMachine(tracer).evaluate(program, context)
+    except StarxlyException as exception:
+        error = exception.error
+    if tracer:
+        tracer.end('execute', 1 if optimize else len(program.opcodes))
     # result, error
-    return result.value, result.error
\ No newline at end of file
+    return value, error
+
+def run_stream(stream, filename='<stdin>'):
+    """
+    Runs every line read from a text stream as a separate program and
+    yields (line_number, value, error) as it goes. Lines are pulled
+    through the stream's buffer one at a time, so memory stays flat
+    however long the input is. Blank lines are skipped. All lines go
+    through one Engine, so no lexer, parser, compiler or virtual machine
+    is set up per line.
+    """
+    engine = Engine(filename)
+    for line_number, line in enumerate(stream):
+        text = line.rstrip('\r\n')
+        if not text.strip(' \t'):
+            continue
+        value, error = engine.run(text, line_number)
+        yield line_number, value, error
+
+def run_file(path, encoding='utf-8'):
+    """Streams the program file at path through run_stream"""
+    with open(path, encoding=encoding) as file:
+        yield from run_stream(file, path)
+
+def run_chunk(filename, texts):
+    """Runs each text in a chunk, used by the worker processes of run_many"""
+    return [run(filename, text) for text in texts]
+
+def run_many(sources, filename='<stdin>', workers=None, chunksize=256):
+    """
+    Runs every source text on a pool of worker processes and yields
+    (value, error) pairs in input order. Only a bounded number of
+    chunks are in flight at once so sources are consumed lazily and
+    results are streamed back as soon as they are ready.
+    """
+    workers = workers or os.cpu_count() or 1
+    sources = iter(sources)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                # Keep every worker busy with one chunk queued behind it
+                while len(pending) < 2 * workers:
+                    chunk = list(islice(sources, chunksize))
+                    if not chunk:
+                        break
+                    pending.append(executor.submit(run_chunk, filename, chunk))
+                if not pending:
+                    return
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+# Characters split_terms has to look at, parentheses for the depth and the signs it may split at
+SPLIT_REGEX = re.compile(r'[()+-]')
+
+def split_terms(text, count):
+    """
+    Splits text into at most count pieces at binary + and - signs
+    outside of any parentheses, spaced about evenly through the text.
+    Returns (operator type, start, end) for every piece, the operator
+    joining it to the piece before or None for the first piece. Text
+    before each split target is only counted for its parentheses, so
+    every character is looked at once and the split stays linear.
+    """
+    pieces = []
+    operator_type = None
+    start = 0
+    depth = 0 # Parenthesis depth at scanned
+    scanned = 0
+    for piece in range(1, count):
+        position = max(len(text) * piece // count, start)
+        depth += text.count('(', scanned, position) - text.count(')', scanned, position)
+        scanned = position
+        for match in SPLIT_REGEX.finditer(text, position):
+            index = match.start()
+            character = text[index]
+            if character == '(':
+                depth += 1
+            elif character == ')':
+                depth -= 1
+            elif depth == 0:
+                previous = index - 1
+                while previous >= 0 and text[previous] in ' \t':
+                    previous -= 1
+                # Binary when it follows the end of an operand, a number or a closing parenthesis
+                if previous >= start and text[previous] in '0123456789.)':
+                    pieces.append((operator_type, start, index))
+                    operator_type = Token.TT_PLUS if character == '+' else Token.TT_MINUS
+                    start = scanned = index + 1
+                    break
+        else:
+            break # No top level sign after position, the rest of the text is one piece
+    pieces.append((operator_type, start, len(text)))
+    return pieces
+
+def evaluate_terms(filename, text):
+    """
+    Evaluates the operands of the top level additions and subtractions
+    of text one by one, used by the worker processes of run_parallel.
+    Returns None when text fails to lex or parse, otherwise (values,
+    operator types, failure) where failure is None or the (start, end)
+    offsets of the divisor of the first division by zero.
+    """
+    tokens, error = RegexLexer(filename, text).tokenize()
+    if error:
+        return None
+    try:
+        node = StackParser(tokens).build()
+    except StarxlyException:
+        return None
+    # Operators outside parentheses, the spine of a parenthesized operand on the left looks the same in the tree
+    top_level = set()
+    depth = 0
+    for token in tokens:
+        if token.type == Token.TT_LPAREN:
+            depth += 1
+        elif token.type == Token.TT_RPAREN:
+            depth -= 1
+        elif depth == 0 and (token.type == Token.TT_PLUS or token.type == Token.TT_MINUS):
+            top_level.add(token)
+    terms = []
+    operator_types = []
+    while isinstance(node, BinaryOperatorNode) and node.operator_token in top_level:
+        terms.append(node.right_node)
+        operator_types.append(node.operator_token.type)
+        node = node.left_node
+    terms.append(node)
+    terms.reverse()
+    operator_types.reverse()
+    values = []
+    compiler = Compiler()
+    virtual_machine = VirtualMachine()
+    context = Context('<program>')
+    try:
+        for term in terms:
+            values.append(term.token.value if isinstance(term, NumberNode) else virtual_machine.evaluate_value(compiler.compile(term), context))
+    except StarxlyException as exception:
+        return values, operator_types, (exception.error.position_start.index, exception.error.position_end.index)
+    return values, operator_types, None
+
+def run_parallel(filename, text, workers=None, threshold=1000000, line_number=0):
+    """
+    Runs one large program with the operands of its top level additions
+    and subtractions spread over a pool of worker processes. Workers
+    evaluate the operands and they are added up here in source order,
+    so the result is exactly that of run and a division by zero gives
+    the same error. Programs shorter than threshold characters or that
+    cannot be split run serially, as do programs that fail to lex or
+    parse so their first error is reported.
+    """
+    workers = workers or os.cpu_count() or 1
+    pieces = split_terms(text, 4 * workers) if workers > 1 and len(text) >= threshold else []
+    if len(pieces) < 2:
+        return run(filename, text, line_number=line_number)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(evaluate_terms, [filename] * len(pieces), [text[start:end] for operator_type, start, end in pieces]))
+    if None in results:
+        return run(filename, text, line_number=line_number)
+    source = SourceText(filename, text, line_number)
+    context = Context('<program>') # Defining our initial root context
+    total = None
+    for (operator_type, start, end), (values, operator_types, failure) in zip(pieces, results):
+        if failure:
+            return None, RunTimeError(source.position(start + failure[0]), source.position(start + failure[1]), 'Division by zero', context)
+        if operator_type is None:
+            total = values[0]
+        elif operator_type == Token.TT_PLUS:
+            total = total + values[0]
+        else:
+            total = total - values[0]
+        for operator_type, value in zip(operator_types, islice(values, 1, None)):
+            total = total + value if operator_type == Token.TT_PLUS else total - value
+    # The result spans the program without its outer parentheses, like the root node does
+    return Number(total).set_context(context).set_position(source.position(len(text) - len(text.lstrip(' \t('))), source.position(len(text.rstrip(' \t)')))), None
+
+class FusedEvaluator:
+    """
+    Per thread state of an Engine. Lexing, parsing and evaluation are
+    fused into one pass: the regular expression matches of RegexLexer
+    are fed to a PrecedenceClimber whose callbacks compute values, and
+    the offsets of the span of every operand are kept on parallel
+    stacks, so no token, node or bytecode object is built.
+    """
+    def __init__(self, filename, context):
+        self.filename = filename
+        self.context = context
+        self.climber = PrecedenceClimber(self.make_number, self.make_binary, self.make_unary, self.syntax_error)
+        self.starts = []
+        self.ends = []
+        self.source = None
+        self.failure = None # Division by zero span or exception raised by the first failing operation, reported once the text is known to lex and parse
+
+    def run(self, text, line_number=0):
+        """Runs text and returns (value, error) like run"""
+        source = self.source = SourceText(self.filename, text, line_number)
+        self.climber.reset()
+        self.starts.clear()
+        self.ends.clear()
+        self.failure = None
+        feed = self.climber.feed
+        group_types = RegexLexer.GROUP_TYPES
+        syntax_error = None
+        for match in RegexLexer.TOKEN_REGEX.finditer(text):
+            group = match.lastindex
+            if group == RegexLexer.WHITESPACE_GROUP:
+                continue
+            if group == RegexLexer.ILLEGAL_GROUP:
+                return None, IllegalCharacterError(source.position(match.start()), source.position(match.end()), "'" + match.group() + "'")
+            if syntax_error:
+                continue # Only an illegal character later on can still change the error
+            if group == RegexLexer.NUMBER_GROUP:
+                token_type = Token.TT_FLOAT if '.' in match.group() else Token.TT_INT
+            else:
+                token_type = group_types[group]
+            try:
+                feed(token_type, match)
+            except StarxlyException as exception:
+                syntax_error = exception.error
+        if syntax_error:
+            return None, syntax_error
+        try:
+            value = feed(Token.TT_EOF, None)
+        except StarxlyException as exception:
+            return None, exception.error
+        failure = self.failure
+        if isinstance(failure, Exception):
+            raise failure
+        if failure:
+            return None, RunTimeError(source.position(failure[0]), source.position(failure[1]), 'Division by zero', self.context)
+        return Number(value).set_context(self.context).set_position(source.position(self.starts[0]), source.position(self.ends[0])), None
+
+    def syntax_error(self, match, details):
+        """Raises the syntax error at a match, or at the end of the text when match is None"""
+        if match is None:
+            start = len(self.source.text)
+            end = start + 1
+        else:
+            start, end = match.span()
+        raise StarxlyException(InvalidSyntaxError(self.source.position(start), self.source.position(end), details))
+
+    def make_number(self, match):
+        numberstring = match.group()
+        self.starts.append(match.start())
+        self.ends.append(match.end())
+        return float(numberstring) if '.' in numberstring else int(numberstring)
+
+    def make_binary(self, left, operator_match, right):
+        right_start = self.starts.pop()
+        right_end = self.ends.pop()
+        self.ends[-1] = right_end
+        if self.failure:
+            return left # Evaluation has stopped at the first failure, only the spans are still needed
+        try:
+            return binary_operation(RegexLexer.GROUP_TYPES[operator_match.lastindex], left, right)
+        except ZeroDivisionError:
+            self.failure = (right_start, right_end)
+        except OverflowError as exception:
+            self.failure = exception
+        return left
+
+    def make_unary(self, operator_match, operand):
+        self.starts[-1] = operator_match.start()
+        if RegexLexer.GROUP_TYPES[operator_match.lastindex] == Token.TT_MINUS and not self.failure:
+            return operand * -1 # Same as Number.multiply(Number(-1)) so -0.0 is preserved for floats
+        return operand
+
+class Engine:
+    """
+    Reusable evaluator for hosts running many programs, possibly from
+    many threads at once. Every thread gets its own FusedEvaluator,
+    created on its first call and reused from then on, the engine
+    itself is never modified after construction so no lock is needed.
+    Results and errors are the same as those of run.
+    """
+    def __init__(self, filename='<stdin>'):
+        self.filename = filename
+        self.context = Context('<program>') # Never modified, shared by the results and errors of every call
+        self.evaluators = threading.local()
+
+    def run(self, text, line_number=0):
+        """Runs text and returns (value, error) like run"""
+        try:
+            evaluator = self.evaluators.evaluator
+        except AttributeError:
+            evaluator = self.evaluators.evaluator = FusedEvaluator(self.filename, self.context)
+        return evaluator.run(text, line_number)
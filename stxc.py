@@ -0,0 +1,203 @@
+"""
+This module stores the compiled programs of a starxly source file
+in a .stxc file next to it, much like Python's .pyc files, so later
+runs can skip the lexer and parser entirely. Every non blank line
+of the source is one program. The .stxc file is keyed by a hash of
+the source and the format version, a stale or corrupt file is
+detected and rebuilt. Fresh files are read through mmap and the
+instruction arrays are used in place without being copied.
+
+Layout, all integers little endian and every section 8 byte aligned:
+    header   magic, version, source hash, program count and a
+             CRC-32 of everything after the header
+    record   line number, kind, start, end, node count and the
+             lengths of the sections below, followed by
+             error details (utf-8), opcodes (one byte each),
+             operands (int64, -1 for none), constant tags (one byte
+             each), constant values (int64 or float64), divisor
+             spans (pairs of int64 offsets) and ints too large for
+             int64 (comma separated decimal text)
+"""
+import hashlib
+import io
+import mmap
+import os
+import struct
+import zlib
+import starxly
+
+MAGIC = b'STXC'
+VERSION = 1
+HEADER = struct.Struct('<4sHxx32sQIxxxx')
+RECORD = struct.Struct('<10q')
+# Record kinds
+KIND_BYTECODE = 0
+KIND_ILLEGAL_CHARACTER = 1
+KIND_INVALID_SYNTAX = 2
+ERROR_KINDS = {starxly.IllegalCharacterError: KIND_ILLEGAL_CHARACTER, starxly.InvalidSyntaxError: KIND_INVALID_SYNTAX}
+# Constant tags
+TAG_INT = 0
+TAG_FLOAT = 1
+TAG_BIG_INT = 2
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+def cache_path(path):
+    """Returns the path of the .stxc file belonging to the source file at path"""
+    return os.path.splitext(path)[0] + '.stxc'
+
+def source_hash(data, encoding):
+    """Hashes the raw source together with the encoding its offsets are counted in"""
+    return hashlib.sha256(encoding.encode('ascii') + b'\0' + data).digest()
+
+def split_lines(text):
+    """Yields (line_number, line) for every non blank line, splitting like run_stream does"""
+    for line_number, line in enumerate(io.StringIO(text, newline=None)):
+        line = line.rstrip('\r\n')
+        if line.strip(' \t'):
+            yield line_number, line
+
+def padding(size):
+    """Returns the zero bytes needed to bring size up to a multiple of 8"""
+    return b'\0' * (-size % 8)
+
+def encode_program(line_number, program, error):
+    """Serializes one compiled program, or the lex or parse error it produced, to bytes"""
+    if error:
+        details = error.details.encode('utf-8')
+        header = RECORD.pack(line_number, ERROR_KINDS[type(error)], error.position_start.index, error.position_end.index, 0, 0, 0, 0, 0, len(details))
+        return header + details + padding(len(details))
+    tags = bytearray()
+    values = []
+    big_ints = []
+    for constant in program.constants:
+        if isinstance(constant, float):
+            tags.append(TAG_FLOAT)
+            values.append(struct.pack('<d', constant))
+        elif INT_MIN <= constant <= INT_MAX:
+            tags.append(TAG_INT)
+            values.append(struct.pack('<q', constant))
+        else:
+            tags.append(TAG_BIG_INT)
+            values.append(struct.pack('<q', len(big_ints)))
+            big_ints.append(str(constant))
+    big_int_text = ','.join(big_ints).encode('ascii')
+    opcodes = bytes(program.opcodes)
+    operands = struct.pack('<{}q'.format(len(program.operands)), *[-1 if operand is None else operand for operand in program.operands])
+    spans = struct.pack('<{}q'.format(2 * len(program.spans)), *[offset for start_token, end_token in program.spans for offset in (start_token.start, end_token.end)])
+    header = RECORD.pack(line_number, KIND_BYTECODE, program.start_token.start, program.end_token.end, program.node_count, len(opcodes), len(tags), len(program.spans), len(big_int_text), 0)
+    return b''.join((
+        header,
+        opcodes, padding(len(opcodes)),
+        operands,
+        bytes(tags), padding(len(tags)),
+        b''.join(values),
+        spans,
+        big_int_text, padding(len(big_int_text)),
+    ))
+
+def write_compiled(path, digest, programs):
+    """Writes programs to the .stxc file at path, replacing it atomically"""
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    body = b''.join(encode_program(line_number, program, error) for line_number, program, error in programs)
+    with open(temporary_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, digest, len(programs), zlib.crc32(body)))
+        file.write(body)
+    os.replace(temporary_path, path)
+
+def read_compiled(path, digest, filename, lines):
+    """
+    Loads the programs in the .stxc file at path. Returns None when
+    the file belongs to another version of the source or of the
+    format, raises ValueError when it is corrupt.
+    """
+    with open(path, 'rb') as file:
+        view = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    if len(view) < HEADER.size:
+        raise ValueError('truncated header')
+    magic, version, stored_digest, count, checksum = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION or stored_digest != digest or count != len(lines):
+        return None
+    if zlib.crc32(view[HEADER.size:]) != checksum:
+        raise ValueError('checksum mismatch')
+
+    def section(size):
+        """Returns the next size bytes of the file and moves past them and their padding"""
+        nonlocal offset
+        if offset + size > len(view):
+            raise ValueError('truncated record')
+        data = view[offset:offset + size]
+        offset += size + (-size % 8)
+        return data
+
+    programs = []
+    offset = HEADER.size
+    for line_number, line in lines:
+        stored_line_number, kind, start, end, node_count, instruction_count, constant_count, span_count, big_int_size, details_size = RECORD.unpack(section(RECORD.size))
+        if stored_line_number != line_number:
+            raise ValueError('record for line {} found where line {} was expected'.format(stored_line_number, line_number))
+        source = starxly.SourceText(filename, line, line_number)
+        if kind != KIND_BYTECODE:
+            details = str(section(details_size), 'utf-8')
+            error_class = starxly.IllegalCharacterError if kind == KIND_ILLEGAL_CHARACTER else starxly.InvalidSyntaxError
+            programs.append((line_number, None, error_class(source.position(start), source.position(end), details)))
+            continue
+        program = starxly.Bytecode(starxly.OffsetToken(None, None, start, start, source), starxly.OffsetToken(None, None, end, end, source))
+        program.node_count = node_count
+        program.opcodes = section(instruction_count)
+        program.operands = section(8 * instruction_count).cast('q')
+        tags = section(constant_count)
+        values = section(8 * constant_count)
+        spans = section(16 * span_count).cast('q')
+        big_ints = str(section(big_int_size), 'ascii').split(',')
+        integers = values.cast('q')
+        floats = values.cast('d')
+        for index, tag in enumerate(tags):
+            if tag == TAG_INT:
+                program.constants.append(integers[index])
+            elif tag == TAG_FLOAT:
+                program.constants.append(floats[index])
+            else:
+                program.constants.append(int(big_ints[integers[index]]))
+        for index in range(0, 2 * span_count, 2):
+            program.spans.append((starxly.OffsetToken(None, None, spans[index], spans[index], source), starxly.OffsetToken(None, None, spans[index + 1], spans[index + 1], source)))
+        programs.append((line_number, program, None))
+    if offset != len(view):
+        raise ValueError('trailing data')
+    return programs
+
+def load(path, encoding='utf-8'):
+    """
+    Returns (line_number, program, error) for every non blank line of
+    the source file at path. Programs come from its .stxc file when it
+    is fresh, otherwise the source is compiled and the .stxc rewritten.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    digest = source_hash(data, encoding)
+    lines = list(split_lines(data.decode(encoding)))
+    compiled_path = cache_path(path)
+    try:
+        programs = read_compiled(compiled_path, digest, path, lines)
+    except (OSError, ValueError, TypeError, IndexError, struct.error):
+        programs = None # Missing or corrupt, rebuild it
+    if programs is not None:
+        return programs
+    programs = []
+    for line_number, line in lines:
+        program, error = starxly.compile_program(path, line, line_number=line_number)
+        programs.append((line_number, program, error))
+    try:
+        write_compiled(compiled_path, digest, programs)
+    except OSError:
+        pass # The cache is only an optimization, the source directory may not be writable
+    return programs
+
+def run_file(path, encoding='utf-8'):
+    """Runs every line of the source file at path like starxly.run_file, using its .stxc file"""
+    for line_number, program, error in load(path, encoding):
+        if error:
+            yield line_number, None, error
+        else:
+            value, error = starxly.execute_program(program)
+            yield line_number, value, error